@@ -2,14 +2,24 @@ import os
 import json
 import sqlite3
 import uuid
+import hashlib
 from pathlib import Path
 from dotenv import load_dotenv
 from bs4 import BeautifulSoup
+import time
+import queue
 import logging
+import argparse
+import threading
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
+import numpy as np
 
-from sentence_transformers import SentenceTransformer
-import torch
+from embedding_store import encode_embedding, sidecar_paths, write_build_id, write_embedding_meta, write_sidecar
+from retrievers import build_ivf, ivf_path, save_ivf, save_quantized
+from lexical import build_fts
 
 # === Logging Setup ===
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
@@ -21,12 +31,50 @@ COURSE_DIR = "markdown_files"
 DB_PATH = "knowledge_base.db"
 CHUNK_SIZE = 750
 CHUNK_OVERLAP = 70
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+SHADOW = "_shadow"        # suffix of the tables an update is built into
+EMBED_BATCH_SIZE = 64     # texts per model.encode call
+EMBED_BUFFER = 2048       # chunks collected across posts/files before embedding
+WRITE_BATCH = 5000        # rows per executemany / transaction
+
+# Insert column order; the embedding is always last
+INSERT_COLUMNS = {
+    "forum_chunks": [
+        "chunk_id", "post_id", "post_number", "topic_id", "topic_title",
+        "author", "created_at", "url", "text", "source_file", "chunk_hash", "embedding",
+    ],
+    "course_chunks": [
+        "chunk_id", "source_file", "section_title", "url", "text", "chunk_hash", "embedding",
+    ],
+}
+BUILD_IVF = True
+IVF_NLIST = None          # None → 4 * sqrt(rows)
+QUANTIZE = []             # first-pass copies for RETRIEVER=int8 / float16 (see --quantize)
+
+# === Ingestion pipeline ===
+INGEST_WORKERS = max(1, (os.cpu_count() or 2) - 1)   # parse/clean/chunk processes
+PARSE_QUEUE = 64          # parsed files in flight ahead of the embedding stage
+WRITE_QUEUE = 4           # row batches waiting for the writer thread
+CHUNK_NAMESPACE = uuid.UUID("6f1c1d2e-3b8a-4c5e-9a57-0d8e2f3b4a61")
 
 # === Load embedding model ===
-device = "cuda" if torch.cuda.is_available() else "cpu"
-logger.info(f"Using PyTorch device: {device}")
+model = None
 
-model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2", device=device)
+
+def get_model():
+    """Load the embedding model on first use.
+
+    Imported lazily so parse worker processes never pull in torch.
+    """
+    global model
+    if model is None:
+        from sentence_transformers import SentenceTransformer
+        import torch
+
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        logger.info(f"Using PyTorch device: {device}")
+        model = SentenceTransformer(MODEL_NAME, device=device)
+    return model
 
 
 # -----------------------------
@@ -44,10 +92,142 @@ def chunk_text(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
     return chunks
 
 
-def embed(texts):
-    """Compute embeddings for text list."""
-    emb = model.encode(texts, convert_to_numpy=True, batch_size=16)
-    return [e.tolist() for e in emb]
+def embed(texts, batch_size=EMBED_BATCH_SIZE):
+    """Compute float32 embeddings for text list.
+
+    Texts are bucketed by length so each batch pads to a similar size,
+    then the embeddings are scattered back into input order.
+    """
+    model = get_model()
+    out = np.empty((len(texts), model.get_sentence_embedding_dimension()), dtype=np.float32)
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+
+    for start in range(0, len(order), batch_size):
+        idx = order[start:start + batch_size]
+        out[idx] = model.encode(
+            [texts[i] for i in idx], convert_to_numpy=True, batch_size=batch_size
+        )
+    return out
+
+
+class RowWriter:
+    """Single writer stage: executes batched INSERTs on its own thread.
+
+    Batches arrive through a bounded queue, so a slow disk back-pressures
+    the embedding stage instead of buffering rows without limit.
+    """
+
+    def __init__(self, conn, suffix="", queue_size=WRITE_QUEUE):
+        self.conn = conn
+        self.suffix = suffix
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.rows_written = 0
+        self.write_seconds = 0.0
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name="kb-writer", daemon=True)
+        self.thread.start()
+
+    def put(self, table, rows):
+        self.queue.put((table, rows))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                continue    # keep draining so producers never block
+
+            table, rows = item
+            columns = INSERT_COLUMNS[table]
+            try:
+                start = time.perf_counter()
+                self.conn.executemany(
+                    f"INSERT INTO {table}{self.suffix} ({', '.join(columns)}) "
+                    f"VALUES ({', '.join('?' * len(columns))})",
+                    rows,
+                )
+                self.conn.commit()
+                self.write_seconds += time.perf_counter() - start
+                self.rows_written += len(rows)
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def rows_per_sec(self):
+        return self.rows_written / self.write_seconds if self.write_seconds else 0.0
+
+
+class ChunkWriter:
+    """Embedding stage: collects chunk rows from many files and embeds them in large batches.
+
+    ``add`` takes the row without its embedding (its last column is the
+    chunk hash). Rows whose hash is in ``reuse`` get the stored embedding
+    straight away; the rest are embedded together once ``buffer_size``
+    chunks are pending. Finished rows are grouped per table into
+    ``write_batch``-sized batches for the RowWriter, one transaction per
+    batch, into ``<table><suffix>``. Memory stays bounded by the buffer
+    and queue sizes no matter how large the corpus is.
+    """
+
+    def __init__(self, conn, suffix="", reuse=None, buffer_size=EMBED_BUFFER,
+                 batch_size=EMBED_BATCH_SIZE, write_batch=WRITE_BATCH):
+        self.rows = RowWriter(conn, suffix)
+        self.reuse = reuse or {}
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.write_batch = write_batch
+        self.pending = []
+        self.ready = {}
+        self.chunks = 0
+        self.reused = 0
+        self.embed_seconds = 0.0
+
+    def insert(self, table, row, emb_bytes):
+        rows = self.ready.setdefault(table, [])
+        rows.append((*row, emb_bytes))
+        if len(rows) >= self.write_batch:
+            self.rows.put(table, self.ready.pop(table))
+
+    def add(self, table, row, text):
+        cached = self.reuse.get(row[-1])
+        if cached is not None:
+            self.insert(table, row, cached)
+            self.reused += 1
+            return
+
+        self.pending.append((table, row, text))
+        if len(self.pending) >= self.buffer_size:
+            self.embed_pending()
+
+    def embed_pending(self):
+        if not self.pending:
+            return
+
+        start = time.perf_counter()
+        embeddings = embed([text for _, _, text in self.pending], batch_size=self.batch_size)
+        self.embed_seconds += time.perf_counter() - start
+
+        for (table, row, _), emb in zip(self.pending, embeddings):
+            self.insert(table, row, encode_embedding(emb))
+
+        self.chunks += len(self.pending)
+        self.pending = []
+
+    def close(self):
+        """Embed what is left, hand the last batches over and wait for the writer."""
+        self.embed_pending()
+        for table in list(self.ready):
+            self.rows.put(table, self.ready.pop(table))
+        self.rows.close()
+
+    def chunks_per_sec(self):
+        return self.chunks / self.embed_seconds if self.embed_seconds else 0.0
 
 
 def clean_html(text):
@@ -66,43 +246,149 @@ def extract_value(obj, keys, default=None):
     return default
 
 
-def create_db():
-    """Recreate SQLite DB with forum + course tables."""
-    if os.path.exists(DB_PATH):
-        os.remove(DB_PATH)
-
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-
-    cur.execute("""
-        CREATE TABLE forum_chunks (
-            chunk_id TEXT PRIMARY KEY,
+def create_tables(cur, suffix=""):
+    """Create the chunk and source tables (``suffix`` names a shadow copy)."""
+    cur.execute(f"""
+        CREATE TABLE forum_chunks{suffix} (
+            id INTEGER PRIMARY KEY,
+            chunk_id TEXT,
             post_id INTEGER,
             post_number INTEGER,
             topic_id INTEGER,
             topic_title TEXT,
             author TEXT,
+            created_at TEXT,
             url TEXT,
             text TEXT,
+            source_file TEXT,
+            chunk_hash TEXT,
             embedding BLOB
         )
     """)
 
-    cur.execute("""
-        CREATE TABLE course_chunks (
-            chunk_id TEXT PRIMARY KEY,
+    cur.execute(f"""
+        CREATE TABLE course_chunks{suffix} (
+            id INTEGER PRIMARY KEY,
+            chunk_id TEXT,
             source_file TEXT,
             section_title TEXT,
             url TEXT,
             text TEXT,
+            chunk_hash TEXT,
             embedding BLOB
         )
     """)
 
+    cur.execute(f"""
+        CREATE TABLE source_files{suffix} (
+            kind TEXT,
+            source_file TEXT,
+            content_hash TEXT,
+            PRIMARY KEY (kind, source_file)
+        )
+    """)
+
+
+def create_indexes(cur):
+    """Secondary indexes, built once the tables are loaded (cheaper than per insert)."""
+    cur.execute("CREATE UNIQUE INDEX idx_forum_chunks_chunk_id ON forum_chunks (chunk_id)")
+    cur.execute("CREATE INDEX idx_forum_chunks_source_file ON forum_chunks (source_file)")
+    cur.execute("CREATE UNIQUE INDEX idx_course_chunks_chunk_id ON course_chunks (chunk_id)")
+    cur.execute("CREATE INDEX idx_course_chunks_source_file ON course_chunks (source_file)")
+
+
+def connect():
+    """Open the DB with bulk-load friendly settings.
+
+    The connection is handed to the writer thread during ingestion, so it
+    is not pinned to the thread that opened it.
+    """
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")      # 64 MiB page cache
+    return conn
+
+
+def create_db():
+    """Recreate SQLite DB with forum + course tables."""
+    for path in (DB_PATH, DB_PATH + "-wal", DB_PATH + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+
+    conn = connect()
+    cur = conn.cursor()
+
+    # Indexes are created on the loaded tables after the shadow swap
+    create_tables(cur)
+
+    write_embedding_meta(conn, get_model().get_sentence_embedding_dimension(), MODEL_NAME)
+    write_build_id(conn)
+
     conn.commit()
     return conn
 
 
+def open_db():
+    """Open the existing DB for an incremental build.
+
+    Falls back to a full rebuild when the DB is missing or predates the
+    integer id / source_file / chunk_hash columns.
+    """
+    if not os.path.exists(DB_PATH):
+        logger.info("No existing knowledge base → full rebuild")
+        return create_db()
+
+    conn = connect()
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(forum_chunks)")}
+    has_sources = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'source_files'"
+    ).fetchone()
+
+    if not {"id", "source_file", "chunk_hash"} <= columns or not has_sources:
+        conn.close()
+        logger.warning("Knowledge base predates content hashes → full rebuild")
+        return create_db()
+
+    if "created_at" not in columns:
+        # Re-parse every forum file to pick up post dates; embeddings are reused by chunk hash
+        logger.warning("Forum chunks predate created_at → re-parsing forum files")
+        conn.execute("UPDATE source_files SET content_hash = '' WHERE kind = 'forum'")
+        conn.commit()
+
+    return conn
+
+
+# -----------------------------
+# Content Hashes
+# -----------------------------
+def file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def chunk_uuid(kind, name, index):
+    """Stable chunk id from its file and position, so rebuilds are reproducible."""
+    return str(uuid.uuid5(CHUNK_NAMESPACE, f"{kind}/{name}#{index}"))
+
+
+def chunk_hash(text):
+    """Embeddings depend only on the chunk text, so that is all we hash."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def scan_sources():
+    """{(kind, file name): (path, content hash)} for every current source file."""
+    sources = {}
+    for kind, folder, ext in (("forum", FORUM_DIR, ".json"), ("course", COURSE_DIR, ".md")):
+        for name in sorted(os.listdir(folder)):
+            if name.endswith(ext):
+                path = os.path.join(folder, name)
+                sources[(kind, name)] = (path, file_hash(path))
+    return sources
+
+
 # -----------------------------
 # Forum JSON Normalizer
 # -----------------------------
@@ -121,12 +407,14 @@ def normalize_post(post, topic_meta):
         "topic_id": topic_meta.get("topic_id"),
         "topic_title": topic_meta.get("topic_title"),
         "author": extract_value(post, ["username", "author", "name", "user"], ""),
+        "created_at": extract_value(post, ["created_at", "date", "timestamp"], None),
         "url": topic_meta["url"],
         "content": content,
     }
 
 
-def process_forum_json(filepath, conn):
+def process_forum_json(filepath):
+    """Parse, clean and chunk one forum file into ``(table, row, text)`` tuples."""
     logger.info(f"📁 Processing forum JSON: {filepath}")
 
     with open(filepath, "r", encoding="utf-8") as f:
@@ -167,41 +455,61 @@ def process_forum_json(filepath, conn):
 
     else:
         logger.warning(f"⚠ Unknown JSON format → skipping: {filepath}")
-        return
+        return []
 
-    inserted = 0
+    rows = []
+    name = os.path.basename(filepath)
 
     for post in posts:
         if not post["content"]:
             continue
 
-        chunks = chunk_text(post["content"])
-        embeddings = embed(chunks)
-
-        for chunk, emb in zip(chunks, embeddings):
-            conn.execute(
-                "INSERT INTO forum_chunks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        for chunk in chunk_text(post["content"]):
+            rows.append((
+                "forum_chunks",
                 (
-                    str(uuid.uuid4()),
+                    chunk_uuid("forum", name, len(rows)),
                     post["post_id"],
                     post["post_number"],
                     post["topic_id"],
                     post["topic_title"],
                     post["author"],
+                    post["created_at"],
                     post["url"],
                     chunk,
-                    json.dumps(emb),
+                    name,
+                    chunk_hash(chunk),
                 ),
-            )
-            inserted += 1
+                chunk,
+            ))
 
-    logger.info(f"✅ Inserted {inserted} chunks from {filepath}")
+    logger.info(f"✅ Chunked {len(rows)} chunks from {filepath}")
+    return rows
 
 
 # -----------------------------
 # Course Markdown Processor
 # -----------------------------
-def process_course_md(filepath, conn):
+def add_course_section(rows, filepath, section_title, url, buffer):
+    """Append one markdown section's chunks to ``rows``."""
+    name = os.path.basename(filepath)
+    for chunk in chunk_text(buffer):
+        rows.append((
+            "course_chunks",
+            (
+                chunk_uuid("course", name, len(rows)),
+                name,
+                section_title,
+                url,
+                chunk,
+                chunk_hash(chunk),
+            ),
+            chunk,
+        ))
+
+
+def process_course_md(filepath):
+    """Split one markdown file by headings and chunk it into ``(table, row, text)`` tuples."""
     logger.info(f"📘 Processing course markdown: {filepath}")
 
     content = Path(filepath).read_text(encoding="utf-8")
@@ -219,28 +527,13 @@ def process_course_md(filepath, conn):
 
     section_title = ""
     buffer = ""
-    total_inserted = 0
+    rows = []
 
     for line in lines:
         if line.strip().startswith("#"):     # new section
             # flush previous
             if buffer.strip():
-                chunks = chunk_text(buffer)
-                embeddings = embed(chunks)
-                for chunk, emb in zip(chunks, embeddings):
-                    conn.execute(
-                        "INSERT INTO course_chunks VALUES (?, ?, ?, ?, ?, ?)",
-                        (
-                            str(uuid.uuid4()),
-                            os.path.basename(filepath),
-                            section_title,
-                            url,
-                            chunk,
-                            json.dumps(emb),
-                        )
-                    )
-                    total_inserted += 1
-
+                add_course_section(rows, filepath, section_title, url, buffer)
                 buffer = ""
 
             section_title = line.strip("# ").strip()
@@ -250,52 +543,175 @@ def process_course_md(filepath, conn):
 
     # flush last
     if buffer.strip():
-        chunks = chunk_text(buffer)
-        embeddings = embed(chunks)
-        for chunk, emb in zip(chunks, embeddings):
-            conn.execute(
-                "INSERT INTO course_chunks VALUES (?, ?, ?, ?, ?, ?)",
-                (
-                    str(uuid.uuid4()),
-                    os.path.basename(filepath),
-                    section_title,
-                    url,
-                    chunk,
-                    json.dumps(emb),
-                )
-            )
-            total_inserted += 1
+        add_course_section(rows, filepath, section_title, url, buffer)
 
-    logger.info(f"✅ Inserted {total_inserted} chunks from {filepath}")
+    logger.info(f"✅ Chunked {len(rows)} chunks from {filepath}")
+    return rows
+
+
+# -----------------------------
+# Parse Stage (process pool)
+# -----------------------------
+def process_source(task):
+    kind, path = task
+    return process_forum_json(path) if kind == "forum" else process_course_md(path)
+
+
+def iter_parsed(tasks, workers=INGEST_WORKERS, window=PARSE_QUEUE):
+    """Yield each task's rows in task order, parsing up to ``window`` files ahead.
+
+    Results come back in submission order whatever the worker count, so
+    the rows written (and their ids) do not depend on ``workers``.
+    """
+    if workers <= 1:
+        for task in tasks:
+            yield process_source(task)
+        return
+
+    # spawn: never fork a parent that may already hold torch threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as pool:
+        in_flight = deque()
+        for task in tasks:
+            in_flight.append(pool.submit(process_source, task))
+            if len(in_flight) >= window:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
 
 
 # -----------------------------
 # MAIN
 # -----------------------------
-def main():
-    logger.info("🔨 Rebuilding knowledge base database...")
-    conn = create_db()
+def main(incremental=False, workers=INGEST_WORKERS):
+    """Build the knowledge base.
+
+    The new tables are always filled as ``*_shadow`` copies and swapped in
+    with one transaction, so the API can keep serving from the DB during an
+    incremental run. Unchanged source files are copied over as-is; changed
+    files are re-chunked and only chunks whose text hash is new get
+    embedded. Files that disappeared simply are not copied.
+    """
+    if incremental:
+        logger.info("🔁 Incremental knowledge base update...")
+        conn = open_db()
+    else:
+        logger.info("🔨 Rebuilding knowledge base database...")
+        conn = create_db()
 
-    # ---- Process Forum JSON ----
-    forum_files = [f for f in os.listdir(FORUM_DIR) if f.endswith(".json")]
-    logger.info(f"📚 Forum JSON Files: {len(forum_files)}")
+    for table in ("forum_chunks", "course_chunks", "source_files"):
+        conn.execute(f"DROP TABLE IF EXISTS {table}{SHADOW}")
+    create_tables(conn.cursor(), SHADOW)
 
-    for file in tqdm(forum_files, desc="Forum JSON Files"):
-        process_forum_json(os.path.join(FORUM_DIR, file), conn)
+    previous = {
+        (kind, name): content_hash
+        for kind, name, content_hash in conn.execute("SELECT kind, source_file, content_hash FROM source_files")
+    }
+    current = scan_sources()
+
+    unchanged = [key for key, (_, h) in current.items() if previous.get(key) == h]
+    todo = [key for key in current if previous.get(key) != current[key][1]]
+    removed = [key for key in previous if key not in current]
+    logger.info(
+        f"📂 Sources: {len(todo)} new/changed, {len(unchanged)} unchanged, {len(removed)} removed"
+    )
+
+    # ---- Carry over unchanged files; keep embeddings of changed ones for reuse ----
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS keep_files (kind TEXT, source_file TEXT)")
+    conn.execute("DELETE FROM keep_files")
+    conn.executemany("INSERT INTO keep_files VALUES (?, ?)", unchanged)
+
+    reuse = {}
+    for kind, table in (("forum", "forum_chunks"), ("course", "course_chunks")):
+        # Named columns, so rows from an older schema copy over (new columns stay NULL)
+        old_columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        columns = ", ".join(c for c in ["id"] + INSERT_COLUMNS[table] if c in old_columns)
+        conn.execute(f"""
+            INSERT INTO {table}{SHADOW} ({columns})
+            SELECT {columns} FROM {table}
+            WHERE source_file IN (SELECT source_file FROM keep_files WHERE kind = ?)
+        """, (kind,))
+
+        changed = [name for k, name in todo if k == kind and (k, name) in previous]
+        for i in range(0, len(changed), 500):
+            batch = changed[i:i + 500]
+            reuse.update(conn.execute(
+                f"SELECT chunk_hash, embedding FROM {table} "
+                f"WHERE source_file IN ({', '.join('?' * len(batch))})",
+                batch,
+            ).fetchall())
+    conn.commit()
 
-    # ---- Process Course Markdown ----
-    course_files = [f for f in os.listdir(COURSE_DIR) if f.endswith(".md")]
-    logger.info(f"📘 Course Markdown Files: {len(course_files)}")
+    # ---- Pipeline: parse pool → embedding stage → writer thread ----
+    tasks = [(kind, current[(kind, name)][0]) for kind, name in todo]
+    logger.info(
+        f"📚 Forum JSON Files: {sum(1 for k, _ in tasks if k == 'forum')}, "
+        f"📘 Course Markdown Files: {sum(1 for k, _ in tasks if k == 'course')} "
+        f"({workers} parse workers)"
+    )
 
-    for file in tqdm(course_files, desc="Course Markdown Files"):
-        process_course_md(os.path.join(COURSE_DIR, file), conn)
+    writer = ChunkWriter(conn, suffix=SHADOW, reuse=reuse)
+    try:
+        for rows in tqdm(iter_parsed(tasks, workers=workers), total=len(tasks), desc="Source files"):
+            for table, row, text in rows:
+                writer.add(table, row, text)
+    finally:
+        writer.close()
+
+    conn.executemany(
+        f"INSERT INTO source_files{SHADOW} VALUES (?, ?, ?)",
+        [(kind, name, h) for (kind, name), (_, h) in current.items()],
+    )
+    conn.commit()
+    logger.info(
+        f"⚡ Embedded {writer.chunks} chunks in {writer.embed_seconds:.1f}s "
+        f"({writer.chunks_per_sec():.1f} chunks/sec, batch_size={writer.batch_size}), "
+        f"reused {writer.reused} unchanged chunk embeddings"
+    )
+    logger.info(
+        f"💾 Wrote {writer.rows.rows_written} rows in {writer.rows.write_seconds:.1f}s "
+        f"({writer.rows.rows_per_sec():.0f} rows/sec)"
+    )
 
+    # ---- Atomic swap: readers see either the old or the new tables ----
+    conn.execute("BEGIN IMMEDIATE")
+    for table in ("forum_chunks", "course_chunks", "source_files"):
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.execute(f"ALTER TABLE {table}{SHADOW} RENAME TO {table}")
+    create_indexes(conn.cursor())
+    build_fts(conn)
+    write_build_id(conn)
     conn.commit()
+
+    # ---- Memory-mapped vector sidecar for the API ----
+    manifest = write_sidecar(conn, DB_PATH, get_model().get_sentence_embedding_dimension())
+    logger.info(f"🧭 Wrote vector sidecar: {manifest['rows']} rows")
+
+    # ---- Approximate (IVF) index over the same rows ----
+    if BUILD_IVF:
+        matrix = np.load(sidecar_paths(DB_PATH)[0], mmap_mode="r")
+        centroids, list_offsets, list_rows = build_ivf(matrix, nlist=IVF_NLIST)
+        save_ivf(ivf_path(DB_PATH), manifest["build_id"], manifest["rows"], centroids, list_offsets, list_rows)
+        logger.info(f"🧭 Wrote IVF index: {len(centroids)} lists")
+
+    # ---- Quantized first-pass copies of the same rows ----
+    for dtype in QUANTIZE:
+        matrix = np.load(sidecar_paths(DB_PATH)[0], mmap_mode="r")
+        nbytes = save_quantized(DB_PATH, dtype, manifest["build_id"], matrix)
+        logger.info(f"🧭 Wrote {dtype} vectors: {nbytes / 2**20:.1f} MB (float32: {matrix.nbytes / 2**20:.1f} MB)")
+
     conn.close()
 
     logger.info("🎉 Knowledge Base Created Successfully!")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Build the Virtual TA knowledge base.")
+    parser.add_argument("--incremental", action="store_true", help="only re-embed new or changed sources")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="parse/chunk worker processes")
+    parser.add_argument("--quantize", nargs="*", choices=["int8", "float16"],
+                        help="also write quantized vector copies (--quantize alone: int8)")
+    args = parser.parse_args()
+    if args.quantize is not None:
+        QUANTIZE = args.quantize or ["int8"]
+    main(incremental=args.incremental, workers=args.workers)
 
@@ -0,0 +1,63 @@
+import time
+import asyncio
+import argparse
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from stage_pool import StagePool
+from embedding_batcher import EmbeddingBatcher
+
+# ------------------------------
+# CONFIG
+# ------------------------------
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+CONCURRENCY_LEVELS = [1, 4, 16, 64]
+REQUESTS_PER_CLIENT = 20
+
+
+async def run_level(batcher, concurrency, requests_per_client):
+    latencies = []
+
+    async def client(cid):
+        for i in range(requests_per_client):
+            # Unique texts so nothing is deduplicated inside a batch
+            text = f"client {cid} question {i}: how do I deploy a FastAPI app with docker?"
+            start = time.perf_counter()
+            await batcher.embed(text)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(c) for c in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return len(latencies) / elapsed, np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+
+async def main(args):
+    model = SentenceTransformer(MODEL_NAME, device="cpu")
+    encode_many = lambda texts: model.encode(texts, convert_to_numpy=True, batch_size=len(texts))
+    encode_many(["warm up"])
+
+    modes = [
+        ("unbatched", 1, 0.0),
+        ("batched", args.max_batch, args.max_wait_ms),
+    ]
+
+    print(f"{'mode':<10} {'clients':>7} {'q/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'mean batch':>11}")
+    for concurrency in args.levels:
+        for name, max_batch, max_wait_ms in modes:
+            pool = StagePool("embed", 1, 10_000)
+            batcher = EmbeddingBatcher(encode_many, pool, max_batch=max_batch, max_wait_ms=max_wait_ms)
+            qps, p50, p99 = await run_level(batcher, concurrency, args.requests)
+            mean_batch = batcher.stats()["mean_batch_size"]
+            print(f"{name:<10} {concurrency:>7} {qps:>9.1f} {p50:>9.1f} {p99:>9.1f} {mean_batch:>11.1f}")
+            pool.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput/latency of micro-batched query embedding.")
+    parser.add_argument("--levels", type=int, nargs="+", default=CONCURRENCY_LEVELS)
+    parser.add_argument("--requests", type=int, default=REQUESTS_PER_CLIENT, help="requests per client")
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    asyncio.run(main(parser.parse_args()))
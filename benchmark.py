@@ -0,0 +1,467 @@
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import platform
+import subprocess
+from datetime import datetime, timedelta, timezone
+
+import aiohttp
+import numpy as np
+
+import base_creation_test as builder
+from embedding_store import sidecar_paths, write_build_id, write_embedding_meta, write_sidecar
+from retrievers import QUANT_DTYPES, build_ivf, ivf_path, quant_paths, save_ivf, save_quantized
+from lexical import build_fts
+
+# ------------------------------
+# CONFIG
+# ------------------------------
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+WORK_DIR = "bench_runs"
+N_CHUNKS = 10_000
+SEED = 0
+
+VOCAB_SIZE = 20_000        # snake_case identifiers; Zipf-distributed like real jargon
+WORDS_PER_CHUNK = 12       # content words; they also define the chunk's embedding
+FILLER_PER_CHUNK = 100     # common words around them (~750 chars, the builder's chunk size)
+FORUM_SHARE = 0.8
+POSTS_PER_TOPIC = 40
+CLUSTER_NOISE = 0.3
+
+API_PORT = 8765
+LLM_PORT = 8766
+LLM_LATENCY_MS = 200
+STARTUP_TIMEOUT = 600
+SEQUENTIAL_QUERIES = 50
+CONCURRENCY = 8
+LOAD_QUERIES = 200
+REGRESSION_THRESHOLD = 0.20   # flag metrics more than 20% worse than the baseline
+
+BASE_WORDS = """
+assignment deadline submission project docker container image port server fastapi uvicorn
+python pandas numpy dataframe csv json api request response token model embedding prompt
+llm openai github repository commit branch workflow deploy vercel render database sqlite
+query index column table join schema scrape crawl playwright selenium html markdown
+notebook colab kernel error traceback module import package install pip venv environment
+variable function argument return exception timeout retry cache memory disk thread process
+score grade marks evaluation rubric exam quiz week lecture video slide regression
+""".split()
+
+FILLER = """
+the a to of and in is for on it that with as this be you can i how what when should
+we are not do if or have but from at my will there your which by so use all also
+""".split()
+
+# Throughput metrics; everything else is a duration (lower is better)
+HIGHER_IS_BETTER = {"ingest.rows_per_s", "load.qps"}
+
+
+# -----------------------------
+# Synthetic Knowledge Base
+# -----------------------------
+def make_vocab(size, rng):
+    """Base course words plus ``size`` snake_case identifiers made from them."""
+    idents = set()
+    while len(idents) < size:
+        idents.add(f"{rng.choice(BASE_WORDS)}_{rng.choice(BASE_WORDS)}_{len(idents) % 97}")
+    return BASE_WORDS + sorted(idents)
+
+
+def word_vectors(vocab, model):
+    vectors = model.encode(vocab, convert_to_numpy=True, batch_size=256).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def synthetic_batches(n_chunks, vocab, vectors, batch_size, seed=SEED):
+    """Yield ``(table, rows)`` batches in the builder's INSERT_COLUMNS order.
+
+    A chunk's embedding is the normalized sum of its content words' vectors
+    plus noise, so questions made of those words land near it in the real
+    model's space and the similarity threshold behaves as it does on the
+    real KB. Text is content words mixed into common filler words.
+    """
+    rng = np.random.default_rng(seed)
+    # Zipf ranks → word ids; rank 1 is the most common word
+    p = 1.0 / np.arange(1, len(vocab) + 1) ** 1.07
+    p /= p.sum()
+    filler = np.array(FILLER)
+    vocab_arr = np.array(vocab)
+    start_date = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+    for start in range(0, n_chunks, batch_size):
+        n = min(batch_size, n_chunks - start)
+        word_ids = rng.choice(len(vocab), size=(n, WORDS_PER_CHUNK), p=p)
+        emb = vectors[word_ids].sum(axis=1)
+        emb /= np.linalg.norm(emb, axis=1, keepdims=True)
+        emb += rng.standard_normal(emb.shape).astype(np.float32) * (CLUSTER_NOISE / np.sqrt(emb.shape[1]))
+        emb /= np.linalg.norm(emb, axis=1, keepdims=True)
+        fillers = rng.integers(0, len(filler), size=(n, FILLER_PER_CHUNK))
+        is_forum = rng.random(n) < FORUM_SHARE
+
+        forum, course = [], []
+        for j in range(n):
+            i = start + j
+            words = list(filler[fillers[j]])
+            for k, w in enumerate(vocab_arr[word_ids[j]]):
+                words[k * FILLER_PER_CHUNK // WORDS_PER_CHUNK] = w
+            text = " ".join(words)
+            chunk_id = str(uuid.UUID(int=i + 1))
+            emb_bytes = emb[j].astype("<f4").tobytes()
+
+            if is_forum[j]:
+                topic_id, post_number = divmod(i, POSTS_PER_TOPIC)
+                created = start_date + timedelta(minutes=i)
+                forum.append((
+                    chunk_id, i, post_number + 1, topic_id, f"Topic {topic_id}",
+                    f"user{i % 500}", created.isoformat(),
+                    f"https://discourse.onlinedegree.iitm.ac.in/t/topic-{topic_id}/{topic_id}/{post_number + 1}",
+                    text, f"topic_{topic_id}.json", builder.chunk_hash(text), emb_bytes,
+                ))
+            else:
+                page = i // 20
+                course.append((
+                    chunk_id, f"page_{page}.md", f"Section {i % 20}",
+                    f"https://tds.s-anand.net/#/page-{page}", text, builder.chunk_hash(text), emb_bytes,
+                ))
+        if forum:
+            yield "forum_chunks", forum
+        if course:
+            yield "course_chunks", course
+
+
+def build_synthetic_kb(db_path, n_chunks, model, seed=SEED):
+    """Write a synthetic KB with the builder's own writer, indexes, FTS, sidecar and IVF.
+
+    Returns the timings of everything after the vocabulary embedding, i.e.
+    the ingest path minus chunk embedding (which depends on the model and
+    hardware, not on this code, and is logged by the builder as chunks/sec).
+    """
+    quant_files = [path for dtype in QUANT_DTYPES for path in quant_paths(db_path, dtype)]
+    for path in (db_path, db_path + "-wal", db_path + "-shm", *sidecar_paths(db_path), ivf_path(db_path), *quant_files):
+        if os.path.exists(path):
+            os.remove(path)
+
+    rng = random.Random(seed)
+    vocab = make_vocab(VOCAB_SIZE, rng)
+    vectors = word_vectors(vocab, model)
+    dim = vectors.shape[1]
+
+    builder.DB_PATH = db_path
+    start = time.perf_counter()
+    conn = builder.connect()
+    builder.create_tables(conn.cursor())
+    write_embedding_meta(conn, dim, builder.MODEL_NAME)
+    conn.commit()
+
+    writer = builder.RowWriter(conn)
+    for table, rows in synthetic_batches(n_chunks, vocab, vectors, builder.WRITE_BATCH, seed):
+        writer.put(table, rows)
+    writer.close()
+    write_s = time.perf_counter() - start
+
+    builder.create_indexes(conn.cursor())
+    build_fts(conn)
+    write_build_id(conn)
+    conn.commit()
+    index_s = time.perf_counter() - start - write_s
+
+    manifest = write_sidecar(conn, db_path, dim)
+    matrix = np.load(sidecar_paths(db_path)[0], mmap_mode="r")
+    centroids, list_offsets, list_rows = build_ivf(matrix, nlist=builder.IVF_NLIST)
+    save_ivf(ivf_path(db_path), manifest["build_id"], manifest["rows"], centroids, list_offsets, list_rows)
+    for dtype in builder.QUANTIZE:
+        save_quantized(db_path, dtype, manifest["build_id"], matrix)
+    conn.close()
+
+    total = time.perf_counter() - start
+    return {
+        "seconds": total,
+        "write_s": write_s,
+        "indexes_fts_s": index_s,
+        "sidecar_ivf_s": total - write_s - index_s,
+        "rows_per_s": n_chunks / total,
+    }, vocab
+
+
+def make_questions(vocab, n, seed):
+    """Unique questions (so neither cache answers them) built from KB words."""
+    rng = random.Random(seed)
+    head = vocab[:len(BASE_WORDS)]
+    tail = vocab[len(BASE_WORDS):]
+    return [
+        f"How do I use {rng.choice(tail)} with {rng.choice(tail)} for the {rng.choice(head)}? (#{i})"
+        for i in range(n)
+    ]
+
+
+# -----------------------------
+# Servers
+# -----------------------------
+def spawn(args, cwd, log_path, env=None):
+    with open(log_path, "w") as log:
+        return subprocess.Popen(
+            [sys.executable, *args], cwd=cwd, env={**os.environ, **(env or {})},
+            stdout=log, stderr=subprocess.STDOUT,
+        )
+
+
+async def wait_until_up(url, proc, timeout=STARTUP_TIMEOUT):
+    """Poll ``url`` until it answers 200; returns seconds waited."""
+    start = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        while time.perf_counter() - start < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"{url} process exited with code {proc.returncode} (see its log in the workdir)")
+            try:
+                async with session.get(url) as resp:
+                    if resp.status == 200:
+                        return time.perf_counter() - start
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.05)
+    raise RuntimeError(f"{url} not up after {timeout}s")
+
+
+def parse_server_timing(header):
+    timings = {}
+    for part in (header or "").split(","):
+        name, _, dur = part.strip().partition(";dur=")
+        if dur:
+            timings[name] = float(dur)
+    return timings
+
+
+def percentiles(values):
+    if not values:
+        return None
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "n": len(values)}
+
+
+# -----------------------------
+# Query Phases
+# -----------------------------
+async def post_query(session, url, question):
+    start = time.perf_counter()
+    async with session.post(url, json={"question": question}) as resp:
+        await resp.read()
+        return resp.status, (time.perf_counter() - start) * 1000, resp.headers.get("Server-Timing")
+
+
+async def sequential_phase(url, questions):
+    """One request at a time: per-stage times without queueing effects."""
+    stages, latencies, errors = {}, [], 0
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=120)) as session:
+        for question in questions:
+            status, ms, header = await post_query(session, url, question)
+            if status != 200:
+                errors += 1
+                continue
+            latencies.append(ms)
+            for name, dur in parse_server_timing(header).items():
+                stages.setdefault(name, []).append(dur)
+    return {name: percentiles(values) for name, values in stages.items()}, percentiles(latencies), errors
+
+
+async def load_phase(url, questions, concurrency):
+    latencies, errors = [], []
+    pending = iter(questions)
+
+    async def client(session):
+        for question in pending:
+            try:
+                status, ms, _ = await post_query(session, url, question)
+            except Exception as e:
+                errors.append(type(e).__name__)
+                continue
+            if status == 200:
+                latencies.append(ms)
+            else:
+                errors.append(status)
+
+    start = time.perf_counter()
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=120)) as session:
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return dict(
+        percentiles(latencies) or {},
+        concurrency=concurrency,
+        qps=len(latencies) / elapsed,
+        errors=len(errors),
+    )
+
+
+async def run_queries(args, workdir, vocab):
+    llm = spawn(
+        ["stub_llm_server.py", "--port", str(args.llm_port), "--latency-ms", str(args.llm_latency_ms)],
+        REPO_DIR, os.path.join(workdir, "stub_llm.log"),
+    )
+    api = None
+    try:
+        await wait_until_up(f"http://127.0.0.1:{args.llm_port}/stats", llm)
+
+        api = spawn(
+            ["-m", "uvicorn", "virtual_ta_api:app", "--port", str(args.port), "--log-level", "warning"],
+            workdir,
+            os.path.join(workdir, "api.log"),
+            {
+                "PYTHONPATH": os.pathsep.join(filter(None, [REPO_DIR, os.getenv("PYTHONPATH")])),
+                "API_KEY": os.getenv("API_KEY", "benchmark"),
+                "OPENAI_BASE_URL": f"http://127.0.0.1:{args.llm_port}/v1",
+                "ANSWER_CACHE_PATH": "",      # every query reaches the (stub) LLM
+                "SERVER_TIMING": "1",
+                "RETRIEVER": args.retriever,
+            },
+        )
+        # Cold start: process launch → model loaded, index mapped, first response
+        cold_start = await wait_until_up(f"http://127.0.0.1:{args.port}/metrics", api)
+        print(f"🚀 API up in {cold_start:.1f}s")
+
+        url = f"http://127.0.0.1:{args.port}/query"
+        questions = make_questions(vocab, args.sequential + args.load_queries, args.seed + 1)
+        stages, query_ms, seq_errors = await sequential_phase(url, questions[:args.sequential])
+        print(f"🔎 {args.sequential} sequential queries done")
+        load = await load_phase(url, questions[args.sequential:], args.concurrency)
+        print(f"📈 {args.load_queries} queries at concurrency {args.concurrency} done")
+    finally:
+        for proc in (api, llm):
+            if proc is not None:
+                proc.terminate()
+                proc.wait()
+
+    return {
+        "cold_start_s": cold_start,
+        # embed/retrieve/prompt/llm_* come from the API's own Server-Timing stages
+        "stages_ms": stages,
+        "query_ms": query_ms,
+        "sequential_errors": seq_errors,
+        "load": load,
+    }
+
+
+# -----------------------------
+# Results
+# -----------------------------
+def flatten(results):
+    """Comparable metrics as ``{"stages_ms.embed.p50": ...}``."""
+    flat = {
+        "ingest.seconds": results["ingest"]["seconds"],
+        "ingest.rows_per_s": results["ingest"]["rows_per_s"],
+    }
+    queries = results.get("queries")
+    if queries:
+        flat["cold_start_s"] = queries["cold_start_s"]
+        for name, stats in {**queries["stages_ms"], "query": queries["query_ms"]}.items():
+            for p in ("p50", "p95"):
+                if stats:
+                    flat[f"stages_ms.{name}.{p}"] = stats[p]
+        for key in ("p50", "p95", "p99", "qps"):
+            if key in queries["load"]:
+                flat[f"load.{key}"] = queries["load"][key]
+    return flat
+
+
+def compare(results, baseline, threshold):
+    """Metrics that got more than ``threshold`` worse than ``baseline``."""
+    if baseline["meta"]["chunks"] != results["meta"]["chunks"]:
+        print(f"⚠️ Baseline has {baseline['meta']['chunks']} chunks, this run {results['meta']['chunks']}")
+
+    current, before = flatten(results), flatten(baseline)
+    regressions = []
+    for name, value in current.items():
+        old = before.get(name)
+        if not old:
+            continue
+        change = value / old - 1
+        worse = -change if name in HIGHER_IS_BETTER else change
+        if worse > threshold:
+            regressions.append({"metric": name, "baseline": old, "current": value, "change": change})
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args):
+    from sentence_transformers import SentenceTransformer
+
+    if args.retriever in QUANT_DTYPES and args.retriever not in builder.QUANTIZE:
+        builder.QUANTIZE = [*builder.QUANTIZE, args.retriever]
+    workdir = os.path.abspath(os.path.join(args.workdir, f"kb_{args.chunks}"))
+    os.makedirs(workdir, exist_ok=True)
+    db_path = os.path.join(workdir, "knowledge_base.db")
+
+    model = SentenceTransformer(builder.MODEL_NAME, device="cpu")
+    print(f"🔨 Building synthetic KB with {args.chunks} chunks in {workdir}")
+    ingest, vocab = build_synthetic_kb(db_path, args.chunks, model, args.seed)
+    print(f"💾 Ingest: {ingest['seconds']:.1f}s ({ingest['rows_per_s']:.0f} rows/s)")
+    del model
+
+    results = {
+        "meta": {
+            "chunks": args.chunks,
+            "seed": args.seed,
+            "retriever": args.retriever,
+            "llm_latency_ms": args.llm_latency_ms,
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "ingest": ingest,
+    }
+    if not args.skip_queries:
+        results["queries"] = asyncio.run(run_queries(args, workdir, vocab))
+
+    flat = flatten(results)
+    for name, value in flat.items():
+        print(f"  {name:<28} {value:10.2f}")
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            results["regressions"] = compare(results, json.load(f), args.threshold)
+        for r in results["regressions"]:
+            print(f"❌ {r['metric']}: {r['baseline']:.2f} → {r['current']:.2f} ({r['change']:+.0%})")
+        if results["regressions"]:
+            exit_code = 1
+        else:
+            print(f"✅ No regressions over {args.threshold:.0%} against {args.baseline}")
+
+    out = args.out or os.path.join(args.workdir, f"results_{args.chunks}_{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"📝 Results written to {out}")
+    return exit_code
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest, cold start, retrieval and /query benchmark on a synthetic KB.")
+    parser.add_argument("--chunks", type=int, default=N_CHUNKS, help="synthetic KB size (10k to 1M)")
+    parser.add_argument("--workdir", default=WORK_DIR)
+    parser.add_argument("--out", help="results JSON (default: <workdir>/results_<chunks>_<time>.json)")
+    parser.add_argument("--baseline", help="earlier results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="allowed slowdown, e.g. 0.2")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--retriever", default="exact", choices=["exact", "ivf", *QUANT_DTYPES])
+    parser.add_argument("--sequential", type=int, default=SEQUENTIAL_QUERIES, help="one-at-a-time queries")
+    parser.add_argument("--load-queries", type=int, default=LOAD_QUERIES)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--llm-latency-ms", type=float, default=LLM_LATENCY_MS)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--llm-port", type=int, default=LLM_PORT)
+    parser.add_argument("--skip-queries", action="store_true", help="only build the KB and time ingest")
+    sys.exit(main(parser.parse_args()))
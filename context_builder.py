@@ -0,0 +1,188 @@
+import numpy as np
+
+try:
+    import tiktoken
+except ImportError:  # optional: fall back to a characters-per-token estimate
+    tiktoken = None
+
+# ------------------------------
+# CONFIG
+# ------------------------------
+TOKEN_BUDGET = 3000        # tokens of retrieved context per prompt
+MAX_BLOCK_TOKENS = 600     # longest single (merged) block kept in the prompt
+MMR_LAMBDA = 0.7           # 1.0 = pure relevance, lower = more diversity
+DUP_THRESHOLD = 0.95       # cosine similarity above which a block is a near-duplicate
+MIN_BLOCK_TOKENS = 50      # don't squeeze a block into less than this
+MIN_OVERLAP = 20           # shortest shared text that counts as an overlap
+OVERLAP_WINDOW = 200       # tail of a chunk searched for the next chunk's head
+CHARS_PER_TOKEN = 4
+
+_encoding = None
+
+
+def count_tokens(text, model="gpt-4o-mini"):
+    """Token count with tiktoken when installed, else a ~4 chars/token estimate."""
+    global _encoding
+    if tiktoken is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text, max_tokens):
+    if count_tokens(text) <= max_tokens:
+        return text
+    if tiktoken is None:
+        return text[:max_tokens * CHARS_PER_TOKEN]
+    return _encoding.decode(_encoding.encode(text, disallowed_special=())[:max_tokens])
+
+
+def join_overlapping(a, b):
+    """``a`` followed by ``b`` if ``b`` starts with text that ``a`` ends with, else None.
+
+    ``chunk_text`` windows share ``CHUNK_OVERLAP`` characters, so consecutive
+    chunks of one post/section are found without knowing their positions.
+    """
+    probe = b[:MIN_OVERLAP]
+    if len(probe) < MIN_OVERLAP:
+        return None
+
+    tail_start = max(0, len(a) - OVERLAP_WINDOW)
+    pos = a.find(probe, tail_start)
+    while pos != -1:
+        shared = len(a) - pos
+        if b[:shared] == a[pos:]:
+            return a + b[shared:]
+        pos = a.find(probe, pos + 1)
+    return None
+
+
+def merge_overlapping(chunks, max_tokens=MAX_BLOCK_TOKENS):
+    """Merge retrieved chunks that are overlapping windows of the same url.
+
+    Returns blocks ``{url, source, text, relevance, chunk_ids, best}`` where
+    ``relevance`` is the best member's score (its fused ``relevance`` from
+    hybrid search, else its cosine ``similarity``) and ``best`` its index
+    in ``chunks``. Merging stops short of ``max_tokens``, so a block never
+    has to be cut and lose members.
+    """
+    blocks = []
+    by_url = {}
+    for i, c in enumerate(chunks):
+        block = {
+            "url": c["url"],
+            "source": c["source"],
+            "text": c["text"],
+            "relevance": c.get("relevance", c["similarity"]),
+            "chunk_ids": [c["chunk_id"]],
+            "best": i,
+        }
+        by_url.setdefault(c["url"], []).append(block)
+        blocks.append(block)
+
+    for group in by_url.values():
+        merged = True
+        while merged and len(group) > 1:
+            merged = False
+            for a in group:
+                for b in group:
+                    if a is b:
+                        continue
+                    text = join_overlapping(a["text"], b["text"])
+                    if text is None or count_tokens(text) > max_tokens:
+                        continue
+                    a["text"] = text
+                    a["chunk_ids"] += b["chunk_ids"]
+                    if b["relevance"] > a["relevance"]:
+                        a["relevance"], a["best"] = b["relevance"], b["best"]
+                    group.remove(b)
+                    blocks.remove(b)
+                    merged = True
+                    break
+                if merged:
+                    break
+
+    return blocks
+
+
+def build_context(
+    chunks,
+    vectors,
+    token_budget=TOKEN_BUDGET,
+    max_block_tokens=MAX_BLOCK_TOKENS,
+    mmr_lambda=MMR_LAMBDA,
+    dup_threshold=DUP_THRESHOLD,
+):
+    """Pick the context blocks for one prompt under ``token_budget``.
+
+    ``chunks`` are retrieval results (best first) and ``vectors`` their
+    normalized embeddings, row for row. Overlapping chunks are merged,
+    near-duplicates dropped, and the rest added greedily by MMR score
+    (relevance minus redundancy with what is already chosen) while they
+    fit. Returns ``(blocks, stats)``.
+    """
+    blocks = merge_overlapping(chunks, max_block_tokens)
+    stats = {"chunks": len(chunks), "merged": len(blocks), "duplicates": 0, "kept": 0, "context_tokens": 0}
+    if not blocks:
+        return [], stats
+
+    vectors = np.asarray(vectors, dtype=np.float32)[[b["best"] for b in blocks]]
+    relevance = np.array([b["relevance"] for b in blocks], dtype=np.float32)
+    redundancy = np.full(len(blocks), -1.0, dtype=np.float32)
+    remaining = list(range(len(blocks)))
+    selected = []
+    budget = token_budget
+
+    while remaining and budget > 0:
+        scores = mmr_lambda * relevance[remaining] - (1 - mmr_lambda) * np.maximum(redundancy[remaining], 0)
+        i = remaining.pop(int(np.argmax(scores)))
+
+        if redundancy[i] >= dup_threshold:
+            stats["duplicates"] += 1
+            continue
+
+        block = blocks[i]
+        limit = min(max_block_tokens, budget)
+        if limit < MIN_BLOCK_TOKENS and count_tokens(block["text"]) > limit:
+            continue  # a shorter block may still fit
+
+        text = block["text"]
+        if count_tokens(text) > limit and len(block["chunk_ids"]) > 1:
+            # Cut down to the best member rather than the block's head
+            text = chunks[block["best"]]["text"]
+        text = truncate_to_tokens(text, limit)
+        tokens = count_tokens(text)
+
+        block["text"] = text
+        block["tokens"] = tokens
+        selected.append(block)
+        budget -= tokens
+        redundancy = np.maximum(redundancy, vectors @ vectors[i])
+
+    stats["kept"] = len(selected)
+    stats["context_tokens"] = token_budget - budget
+    return selected, stats
+
+
+if __name__ == "__main__":
+    # Self-check: seven overlapping windows of one post, best one last. The
+    # merged text is far over MAX_BLOCK_TOKENS; the best window must survive.
+    words = [f"word{i}" for i in range(2000)]
+    text = " ".join(words)
+    step, size = 800, 1000       # characters, like chunk_text's overlapping windows
+    windows = [text[i:i + size] for i in range(0, step * 7, step)]
+    chunks = [
+        {"chunk_id": f"c{i}", "url": "u", "source": "forum", "text": w, "similarity": 0.5 + i * 0.05}
+        for i, w in enumerate(windows)
+    ]
+    vectors = np.eye(len(chunks), dtype=np.float32)
+
+    blocks, stats = build_context(chunks, vectors)
+    assert any(windows[-1] in b["text"] for b in blocks), stats
+    assert all(b["tokens"] <= MAX_BLOCK_TOKENS for b in blocks), stats
+    assert sum(len(b["chunk_ids"]) for b in blocks) == len(chunks), stats
+    print(f"✅ Best window kept: {stats}")
@@ -1,8 +1,13 @@
 import os
 import json
-import requests
+import time
+import random
+import asyncio
+import argparse
+from email.utils import parsedate_to_datetime
 from datetime import datetime, timezone
-from urllib.parse import urljoin
+
+import aiohttp
 from playwright.sync_api import sync_playwright
 
 # ------------------------------
@@ -17,10 +22,21 @@ END_DATE   = "2025-04-15"
 
 OUTPUT_DIR = "discourse_json"
 AUTH_STATE_FILE = "auth.json"
+CHECKPOINT_FILE = "completed_topics.txt"   # inside OUTPUT_DIR; one finished topic id per line
+SYNC_STATE_FILE = "sync_state.json"         # inside OUTPUT_DIR; watermarks for --sync
 
 POST_BATCH = 50
 MAX_EMPTY = 5
 
+CONCURRENCY = 8           # requests in flight
+RATE_LIMIT = 4.0          # requests per second, averaged
+RATE_BURST = 8            # requests allowed back to back after an idle spell
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0        # seconds; doubled per attempt, with full jitter
+BACKOFF_MAX = 60.0
+REQUEST_TIMEOUT = 20
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
 
 # ------------------------------
 # AUTH / LOGIN HANDLING
@@ -59,11 +75,178 @@ def load_cookie_headers():
     }
 
 
+# ------------------------------
+# RATE LIMITED CLIENT
+# ------------------------------
+
+class TokenBucket:
+    """``rate`` tokens per second, holding at most ``burst``; ``acquire`` waits for one."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Push the next token ``seconds`` out (used when the server says Retry-After)."""
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+def retry_after_seconds(value):
+    """``Retry-After`` as seconds: either a number or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class DiscourseClient:
+    """Shared aiohttp session with a concurrency cap, token bucket and retries.
+
+    429 and 5xx responses and dropped connections are retried with
+    full-jitter exponential backoff; a 429's ``Retry-After`` is honoured
+    and also pauses the bucket, so every other request backs off too.
+    """
+
+    def __init__(self, base_url, headers, concurrency=CONCURRENCY, rate=RATE_LIMIT, burst=RATE_BURST,
+                 max_retries=MAX_RETRIES):
+        self.base_url = base_url.rstrip("/")
+        self.headers = headers
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.session = None
+        self.requests = 0
+        self.retries = 0
+        self.rate_limited = 0
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def get_json(self, path, params=None):
+        url = f"{self.base_url}{path}"
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            async with self.semaphore:
+                await self.bucket.acquire()
+                self.requests += 1
+                try:
+                    async with self.session.get(url, params=params) as r:
+                        if r.status == 200:
+                            return await r.json()
+                        error = f"HTTP {r.status}"
+                        if r.status not in RETRY_STATUSES:
+                            r.raise_for_status()
+                        if r.status == 429:
+                            self.rate_limited += 1
+                            retry_after = retry_after_seconds(r.headers.get("Retry-After"))
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    error = type(e).__name__
+
+            if attempt == self.max_retries:
+                raise RuntimeError(f"{url}: {error} after {attempt + 1} attempts")
+
+            delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+                self.bucket.pause(retry_after)
+            self.retries += 1
+            print(f"   ⚠ {error} on {path}, retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+# ------------------------------
+# CHECKPOINT
+# ------------------------------
+
+class Checkpoint:
+    """Append-only file of completed topic ids, so an interrupted run resumes."""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.done = {int(line) for line in f if line.strip().isdigit()}
+
+    def mark(self, topic_id):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(f"{topic_id}\n")
+        self.done.add(topic_id)
+
+
+class SyncState:
+    """Watermarks for ``--sync``: per topic the last ``bumped_at`` and highest post id
+    saved, plus the newest ``bumped_at`` of a fully synced run.
+
+    Saved after every topic (temp file + rename), so an interrupted sync
+    keeps the topics it finished.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.watermark = None
+        self.topics = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.watermark = data.get("watermark")
+            self.topics = data.get("topics", {})
+
+    def changed(self, topic):
+        known = self.topics.get(str(topic["id"]))
+        return known is None or parse_time(topic.get("bumped_at")) > parse_time(known["bumped_at"])
+
+    def update(self, topic_id, bumped_at, highest_post_id):
+        self.topics[str(topic_id)] = {"bumped_at": bumped_at, "highest_post_id": highest_post_id}
+        self.save()
+
+    def save(self):
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"watermark": self.watermark, "topics": self.topics}, f, indent=2)
+        os.replace(self.path + ".tmp", self.path)
+
+
+def parse_time(value):
+    """Discourse timestamp → aware datetime (the epoch when missing)."""
+    if not value:
+        return datetime.fromtimestamp(0, timezone.utc)
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
 # ------------------------------
 # FETCH TOPIC LIST
 # ------------------------------
 
-def fetch_topics_in_range(headers, start_dt, end_dt):
+async def fetch_topics_in_range(client, start_dt, end_dt):
     """Paginate through category pages and collect topic IDs."""
     ids = []
     empty = 0
@@ -72,17 +255,15 @@ def fetch_topics_in_range(headers, start_dt, end_dt):
     print(f"\nFetching topics between {start_dt} and {end_dt}")
 
     while True:
-        url = f"{BASE_URL}/c/{CATEGORY_SLUG}/{CATEGORY_ID}.json?order=created&page={page}"
-        print(f"Page {page}: {url}")
+        path = f"/c/{CATEGORY_SLUG}/{CATEGORY_ID}.json"
+        print(f"Page {page}: {path}")
 
         try:
-            r = requests.get(url, headers=headers, timeout=20)
-            r.raise_for_status()
+            data = await client.get_json(path, params={"order": "created", "page": page})
         except Exception as e:
             print(f"❌ Error fetching page {page}: {e}")
             break
 
-        data = r.json()
         topics = data.get("topic_list", {}).get("topics", [])
 
         if not topics:
@@ -104,12 +285,11 @@ def fetch_topics_in_range(headers, start_dt, end_dt):
 
             try:
                 t = datetime.fromisoformat(created_at.replace("Z", "+00:00"))
-            except:
+            except ValueError:
                 continue
 
             if start_dt <= t <= end_dt:
                 ids.append(topic["id"])
-                print(f"   ✔ Found topic {topic['id']} at {created_at}")
 
         # Check if more pages available
         more = data.get("topic_list", {}).get("more_topics_url")
@@ -119,26 +299,69 @@ def fetch_topics_in_range(headers, start_dt, end_dt):
 
         page += 1
 
-    print(f"\nTotal topics found: {len(ids)}")
-    return list(set(ids))
+    print(f"\nTotal topics found: {len(set(ids))}")
+    return list(dict.fromkeys(ids))
+
+
+async def fetch_changed_topics(client, state, start_dt, end_dt):
+    """Topics in the date range bumped since their per-topic watermark.
+
+    Pages are read in Discourse's default (latest activity first) order
+    and pagination stops at the first unpinned topic not bumped since the
+    global watermark: everything after it is older still. Returns the
+    topics' list entries and the newest ``bumped_at`` seen.
+    """
+    watermark = parse_time(state.watermark) if state.watermark else None
+    changed, newest, page = [], state.watermark, 0
+    print(f"\nSyncing topics bumped since {state.watermark or 'the beginning'}")
+
+    while True:
+        path = f"/c/{CATEGORY_SLUG}/{CATEGORY_ID}.json"
+        data = await client.get_json(path, params={"page": page})
+        topics = data.get("topic_list", {}).get("topics", [])
+
+        passed = False
+        for topic in topics:
+            bumped = parse_time(topic.get("bumped_at"))
+            if newest is None or bumped > parse_time(newest):
+                newest = topic.get("bumped_at")
+            if watermark is not None and bumped <= watermark:
+                # Pinned topics sit on top whatever their age
+                passed = passed or not topic.get("pinned")
+                continue
+            created = parse_time(topic.get("created_at"))
+            if start_dt <= created <= end_dt and state.changed(topic):
+                changed.append(topic)
+
+        print(f"Page {page}: {len(topics)} topics, {len(changed)} changed so far")
+        if passed or not topics or not data.get("topic_list", {}).get("more_topics_url"):
+            break
+        page += 1
+
+    return changed, newest
 
 
 # ------------------------------
 # FETCH FULL TOPIC JSON
 # ------------------------------
 
-def fetch_full_topic(topic_id, headers):
-    print(f"→ Fetching topic {topic_id}")
-    url = f"{BASE_URL}/t/{topic_id}.json"
+async def fetch_posts(client, topic_id, post_ids):
+    """Posts by id through ``posts.json?post_ids[]=``, POST_BATCH per request, concurrently."""
+    async def batch(ids):
+        params = [("post_ids[]", pid) for pid in ids]
+        # Errors propagate: a topic with missing posts is not checkpointed, so a re-run fetches it again
+        posts = await client.get_json(f"/t/{topic_id}/posts.json", params=params)
+        # Discourse wraps them in post_stream; accept a bare list too
+        return posts.get("post_stream", {}).get("posts", []) if isinstance(posts, dict) else posts
+
+    batches = await asyncio.gather(*(
+        batch(post_ids[i:i + POST_BATCH]) for i in range(0, len(post_ids), POST_BATCH)
+    ))
+    return [p for posts in batches for p in posts]
 
-    try:
-        r = requests.get(url, headers=headers, timeout=20)
-        r.raise_for_status()
-    except Exception as e:
-        print(f"❌ Failed: {e}")
-        return None
 
-    topic_data = r.json()
+async def fetch_full_topic(client, topic_id):
+    topic_data = await client.get_json(f"/t/{topic_id}.json")
 
     # Get missing post IDs
     stream = topic_data.get("post_stream", {})
@@ -146,21 +369,8 @@ def fetch_full_topic(topic_id, headers):
     loaded_posts = {p["id"]: p for p in stream.get("posts", [])}
     missing = [pid for pid in all_ids if pid not in loaded_posts]
 
-    # Batch fetch missing posts
-    for i in range(0, len(missing), POST_BATCH):
-        batch = missing[i:i + POST_BATCH]
-        params = [("post_ids[]", pid) for pid in batch]
-        purl = f"{BASE_URL}/t/{topic_id}/posts.json"
-
-        try:
-            r2 = requests.get(purl, params=params, headers=headers, timeout=20)
-            r2.raise_for_status()
-            posts = r2.json()
-            if isinstance(posts, list):
-                for p in posts:
-                    loaded_posts[p["id"]] = p
-        except Exception as e:
-            print(f"   ⚠ Error fetching batch {batch}: {e}")
+    for p in await fetch_posts(client, topic_id, missing):
+        loaded_posts[p["id"]] = p
 
     # Reorder posts according to stream
     topic_data["post_stream"]["posts"] = [loaded_posts[pid] for pid in all_ids if pid in loaded_posts]
@@ -168,48 +378,167 @@ def fetch_full_topic(topic_id, headers):
     return topic_data
 
 
+async def fetch_topic_update(client, topic_id, saved, highest_post_id):
+    """Topic JSON with ``saved`` posts kept and only the new ones fetched.
+
+    Posts above ``highest_post_id`` come from ``posts.json?post_ids[]=``,
+    minus those the topic page already inlines; older ones are kept as saved.
+    """
+    topic_data = await client.get_json(f"/t/{topic_id}.json")
+    stream = topic_data.get("post_stream", {})
+    all_ids = stream.get("stream", [])
+
+    posts = {p["id"]: p for p in saved["post_stream"]["posts"]}
+    posts.update({p["id"]: p for p in stream.get("posts", [])})
+    new = [pid for pid in all_ids if pid > highest_post_id and pid not in posts]
+
+    for p in await fetch_posts(client, topic_id, new):
+        posts[p["id"]] = p
+
+    # Posts deleted upstream drop out with the stream
+    topic_data["post_stream"]["posts"] = [posts[pid] for pid in all_ids if pid in posts]
+    return topic_data, sum(pid > highest_post_id for pid in all_ids)
+
+
 # ------------------------------
 # SAVE JSON
 # ------------------------------
 
-def save_topic(topic_id, data):
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    path = os.path.join(OUTPUT_DIR, f"topic_{topic_id}.json")
-    with open(path, "w", encoding="utf-8") as f:
+def save_topic(topic_id, data, output_dir=OUTPUT_DIR):
+    """Write via a temp file, so a crash never leaves a half-written topic behind."""
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"topic_{topic_id}.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
         json.dump(data, f, indent=2, ensure_ascii=False)
-    print(f"   ✔ Saved {path}")
+    os.replace(path + ".tmp", path)
+    return path
 
 
 # ------------------------------
 # MAIN
 # ------------------------------
 
-def main():
-    print("\n=== Starting Discourse Downloader ===\n")
+async def download_topics(client, topic_ids, checkpoint, output_dir=OUTPUT_DIR):
+    """Fetch and save every topic not yet in ``checkpoint``; returns (saved, failed)."""
+    todo = [tid for tid in topic_ids if tid not in checkpoint.done]
+    print(f"\nDownloading {len(todo)} topics ({len(topic_ids) - len(todo)} already done)...\n")
+    saved, failed = 0, []
 
-    login_if_needed()
-    headers = load_cookie_headers()
-
-    start_dt = datetime.fromisoformat(START_DATE + "T00:00:00").replace(tzinfo=timezone.utc)
-    end_dt   = datetime.fromisoformat(END_DATE   + "T23:59:59").replace(tzinfo=timezone.utc)
-
-    topic_ids = fetch_topics_in_range(headers, start_dt, end_dt)
-
-    if not topic_ids:
-        print("❌ No topics found in date range.")
-        return
-
-    print(f"\nDownloading {len(topic_ids)} topics...\n")
-
-    for i, tid in enumerate(topic_ids, 1):
-        print(f"[{i}/{len(topic_ids)}] Topic {tid}")
-        data = fetch_full_topic(tid, headers)
-        if data:
-            save_topic(tid, data)
-
-    print("\n✔ DONE")
+    async def one(tid):
+        nonlocal saved
+        try:
+            data = await fetch_full_topic(client, tid)
+        except Exception as e:
+            print(f"❌ Topic {tid} failed: {e}")
+            failed.append(tid)
+            return
+        path = await asyncio.to_thread(save_topic, tid, data, output_dir)
+        checkpoint.mark(tid)
+        saved += 1
+        print(f"   ✔ [{saved}/{len(todo)}] Saved {path}")
+
+    # The client's semaphore caps requests; topics just queue up behind it
+    await asyncio.gather(*(one(tid) for tid in todo))
+    return saved, failed
+
+
+async def sync_topics(client, topics, state, output_dir=OUTPUT_DIR):
+    """Bring every changed topic up to date; returns (synced, new_posts, failed)."""
+    print(f"\nSyncing {len(topics)} changed topics...\n")
+    synced, new_posts, failed = 0, 0, []
+
+    async def one(topic):
+        nonlocal synced, new_posts
+        tid = topic["id"]
+        path = os.path.join(output_dir, f"topic_{tid}.json")
+        known = state.topics.get(str(tid))
+        try:
+            if known is not None and os.path.exists(path):
+                with open(path, encoding="utf-8") as f:
+                    saved = json.load(f)
+                data, fetched = await fetch_topic_update(client, tid, saved, known["highest_post_id"])
+            else:
+                data = await fetch_full_topic(client, tid)
+                fetched = len(data["post_stream"]["posts"])
+        except Exception as e:
+            print(f"❌ Topic {tid} failed: {e}")
+            failed.append(tid)
+            return
+
+        await asyncio.to_thread(save_topic, tid, data, output_dir)
+        post_ids = [p["id"] for p in data["post_stream"]["posts"]]
+        state.update(tid, topic.get("bumped_at"), max(post_ids, default=0))
+        synced += 1
+        new_posts += fetched
+        print(f"   ✔ [{synced}/{len(topics)}] Topic {tid}: {fetched} new posts")
+
+    await asyncio.gather(*(one(topic) for topic in topics))
+    return synced, new_posts, failed
+
+
+async def run_sync(args, client, start_dt, end_dt):
+    state = SyncState(os.path.join(args.output_dir, SYNC_STATE_FILE))
+    topics, newest = await fetch_changed_topics(client, state, start_dt, end_dt)
+    synced, new_posts, failed = await sync_topics(client, topics, state, args.output_dir)
+
+    # Only move the global watermark once every changed topic made it
+    if not failed:
+        state.watermark = newest
+        state.save()
+    print(f"\n✔ Synced {synced} topics ({new_posts} new posts), {len(failed)} failed; watermark {state.watermark}")
+    return failed
+
+
+async def run(args):
+    headers = {"User-Agent": "Mozilla/5.0", "Accept": "application/json"}
+    if not args.no_auth:
+        login_if_needed()
+        headers = load_cookie_headers()
+
+    start_dt = datetime.fromisoformat(args.start + "T00:00:00").replace(tzinfo=timezone.utc)
+    end_dt   = datetime.fromisoformat(args.end   + "T23:59:59").replace(tzinfo=timezone.utc)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    checkpoint_path = os.path.join(args.output_dir, CHECKPOINT_FILE)
+    if args.restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    checkpoint = Checkpoint(checkpoint_path)
+
+    started = time.perf_counter()
+    async with DiscourseClient(args.base_url, headers, args.concurrency, args.rate, args.burst) as client:
+        if args.sync:
+            failed = await run_sync(args, client, start_dt, end_dt)
+            print(
+                f"Took {time.perf_counter() - started:.1f}s "
+                f"({client.requests} requests, {client.retries} retries, {client.rate_limited} rate-limited)"
+            )
+            return 1 if failed else 0
+
+        topic_ids = await fetch_topics_in_range(client, start_dt, end_dt)
+        if not topic_ids:
+            print("❌ No topics found in date range.")
+            return 1
+        saved, failed = await download_topics(client, topic_ids, checkpoint, args.output_dir)
+
+    print(
+        f"\n✔ DONE: {saved} saved, {len(failed)} failed in {time.perf_counter() - started:.1f}s "
+        f"({client.requests} requests, {client.retries} retries, {client.rate_limited} rate-limited)"
+    )
+    if failed:
+        print(f"Re-run to retry the failed topics: {sorted(failed)}")
+    return 1 if failed else 0
 
 
 if __name__ == "__main__":
-    main()
-
+    parser = argparse.ArgumentParser(description="Download Discourse topics created in a date range.")
+    parser.add_argument("--base-url", default=BASE_URL, help="e.g. http://127.0.0.1:8002 for fake_discourse_server.py")
+    parser.add_argument("--start", default=START_DATE)
+    parser.add_argument("--end", default=END_DATE)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=RATE_LIMIT, help="requests per second")
+    parser.add_argument("--burst", type=int, default=RATE_BURST)
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and fetch everything")
+    parser.add_argument("--sync", action="store_true", help="only fetch topics and posts new since the last sync")
+    parser.add_argument("--no-auth", action="store_true", help="skip the browser login (fake server)")
+    raise SystemExit(asyncio.run(run(parser.parse_args())))
@@ -0,0 +1,79 @@
+import asyncio
+import threading
+from collections import Counter
+
+
+class EmbeddingBatcher:
+    """Coalesces concurrent query embeddings into one ``encode`` call.
+
+    The first waiting text starts a ``max_wait_ms`` timer; the batch is
+    sent when the timer fires or ``max_batch`` texts are waiting, whichever
+    comes first. ``encode_many`` runs in ``pool`` (a StagePool), so while
+    one batch is on the model the next one keeps filling. Identical texts
+    in a batch are encoded once.
+    """
+
+    def __init__(self, encode_many, pool, max_batch=32, max_wait_ms=5.0):
+        self.encode_many = encode_many
+        self.pool = pool
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._pending = []
+        self._timer = None
+        self._lock = threading.Lock()
+
+        self.batches = 0
+        self.items = 0
+        self.batch_sizes = Counter()
+
+    async def embed(self, text):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            embeddings = await self.pool.run(self.encode_many, texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        by_text = dict(zip(texts, embeddings))
+        for text, future in batch:
+            if not future.done():
+                future.set_result(by_text[text])
+
+        with self._lock:
+            self.batches += 1
+            self.items += len(batch)
+            self.batch_sizes[len(batch)] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait * 1000,
+                "batches": self.batches,
+                "items": self.items,
+                "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+                "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            }
@@ -0,0 +1,185 @@
+import os
+import json
+import uuid
+import numpy as np
+
+# === Config ===
+CHUNK_TABLES = ["forum_chunks", "course_chunks"]
+EMBEDDING_FORMAT = "f32le"       # raw little-endian float32, no per-row header
+EMBEDDING_FORMAT_VERSION = 1
+EMBEDDING_DTYPE = np.dtype("<f4")
+
+
+# -----------------------------
+# Encode / Decode
+# -----------------------------
+def encode_embedding(vec) -> bytes:
+    """Pack one embedding as raw little-endian float32 bytes."""
+    return np.asarray(vec, dtype=EMBEDDING_DTYPE).tobytes()
+
+
+def decode_embedding(value) -> np.ndarray:
+    """Unpack an embedding stored either as float32 bytes or legacy JSON text."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return np.frombuffer(value, dtype=EMBEDDING_DTYPE)
+    return np.asarray(json.loads(value), dtype=np.float32)
+
+
+# -----------------------------
+# Metadata Table
+# -----------------------------
+def create_meta_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS kb_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    """)
+
+
+def write_embedding_meta(conn, dim, model_name):
+    """Record how the embedding column is encoded."""
+    create_meta_table(conn)
+    conn.executemany(
+        "INSERT OR REPLACE INTO kb_meta (key, value) VALUES (?, ?)",
+        [
+            ("embedding_format", EMBEDDING_FORMAT),
+            ("embedding_format_version", str(EMBEDDING_FORMAT_VERSION)),
+            ("embedding_dim", str(dim)),
+            ("embedding_model", model_name),
+        ],
+    )
+
+
+def read_meta(conn) -> dict:
+    """Return kb_meta as a dict ({} for databases built before it existed)."""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'kb_meta'"
+    ).fetchone()
+    if not exists:
+        return {}
+    return dict(conn.execute("SELECT key, value FROM kb_meta").fetchall())
+
+
+def write_build_id(conn) -> str:
+    """Stamp the database with a fresh id; sidecars built from it record the same id."""
+    create_meta_table(conn)
+    build_id = uuid.uuid4().hex
+    conn.execute("INSERT OR REPLACE INTO kb_meta (key, value) VALUES ('build_id', ?)", (build_id,))
+    return build_id
+
+
+# -----------------------------
+# Normalised Matrix
+# -----------------------------
+def build_matrix(conn, dim):
+    """Read every chunk embedding into one L2-normalised float32 matrix.
+
+    Returns ``(matrix, row_keys)`` where ``row_keys[i]`` is the
+    ``(table, chunk_id)`` of matrix row ``i``. Undecodable, wrong-dimension
+    and zero vectors are left out.
+    """
+    vectors, row_keys = [], []
+
+    for table in CHUNK_TABLES:
+        for chunk_id, value in conn.execute(f"SELECT chunk_id, embedding FROM {table}"):
+            try:
+                emb = decode_embedding(value)
+            except Exception:
+                continue
+            if emb.shape != (dim,):
+                continue
+            vectors.append(emb)
+            row_keys.append((table, chunk_id))
+
+    matrix = np.vstack(vectors).astype(np.float32) if vectors else np.empty((0, dim), dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1)
+    keep = norms > 0
+
+    matrix = np.ascontiguousarray(matrix[keep] / norms[keep, None], dtype=np.float32)
+    row_keys = [key for key, k in zip(row_keys, keep) if k]
+    return matrix, row_keys
+
+
+def count_chunks(conn) -> int:
+    return sum(conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in CHUNK_TABLES)
+
+
+# -----------------------------
+# Memory-mapped Sidecar
+# -----------------------------
+def sidecar_paths(db_path):
+    """``knowledge_base.db`` → ``knowledge_base.vectors.npy`` + ``.vectors.json``."""
+    base = os.path.splitext(db_path)[0]
+    return f"{base}.vectors.npy", f"{base}.vectors.json"
+
+
+def write_sidecar(conn, db_path, dim):
+    """Dump the normalised matrix next to the DB plus a vector_rows id table.
+
+    Files are written under a temp name and renamed into place so running
+    workers that still map the old file keep a consistent view.
+    """
+    matrix, row_keys = build_matrix(conn, dim)
+    build_id = read_meta(conn).get("build_id") or write_build_id(conn)
+
+    conn.execute("DROP TABLE IF EXISTS vector_rows")
+    conn.execute("""
+        CREATE TABLE vector_rows (
+            row INTEGER PRIMARY KEY,
+            source_table TEXT,
+            chunk_id TEXT
+        )
+    """)
+    conn.executemany(
+        "INSERT INTO vector_rows (row, source_table, chunk_id) VALUES (?, ?, ?)",
+        [(i, table, chunk_id) for i, (table, chunk_id) in enumerate(row_keys)],
+    )
+    conn.commit()
+
+    npy_path, manifest_path = sidecar_paths(db_path)
+    np.save(npy_path + ".tmp.npy", matrix)
+    os.replace(npy_path + ".tmp.npy", npy_path)
+
+    manifest = {
+        "build_id": build_id,
+        "rows": int(matrix.shape[0]),
+        "dim": int(dim),
+        "chunk_count": count_chunks(conn),
+    }
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    return manifest
+
+
+def open_sidecar(conn, db_path, dim):
+    """Map the sidecar read-only.
+
+    Returns ``((matrix, row_keys), "ok")``, or ``(None, reason)`` when the
+    sidecar is missing or stale relative to the database.
+    """
+    npy_path, manifest_path = sidecar_paths(db_path)
+    if not (os.path.exists(npy_path) and os.path.exists(manifest_path)):
+        return None, "missing"
+
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    if manifest.get("build_id") != read_meta(conn).get("build_id"):
+        return None, "build_id differs from kb_meta"
+    if manifest.get("dim") != dim:
+        return None, f"dim {manifest.get('dim')} != {dim}"
+    if manifest.get("chunk_count") != count_chunks(conn):
+        return None, "chunk tables changed since the sidecar was written"
+
+    matrix = np.load(npy_path, mmap_mode="r")
+    if matrix.shape != (manifest["rows"], dim) or matrix.dtype != np.float32:
+        return None, f"matrix shape {matrix.shape} does not match manifest"
+
+    row_keys = conn.execute("SELECT source_table, chunk_id FROM vector_rows ORDER BY row").fetchall()
+    if len(row_keys) != matrix.shape[0]:
+        return None, "vector_rows does not match matrix"
+
+    return (matrix, row_keys), "ok"
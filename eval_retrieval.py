@@ -0,0 +1,139 @@
+import re
+import json
+import time
+import random
+import sqlite3
+import argparse
+
+import numpy as np
+
+from embedding_store import CHUNK_TABLES, build_matrix, open_sidecar, read_meta
+from retrievers import BruteForceRetriever, rrf_fuse, select_top_k
+from lexical import LexicalIndex
+
+# ------------------------------
+# CONFIG
+# ------------------------------
+DB_PATH = "knowledge_base.db"
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+SIMILARITY_THRESHOLD = 0.40
+TOP_K = 10
+N_QUERIES = 200
+
+# Tokens that embeddings tend to blur: assignment codes (GA4), identifiers
+# (image_to_string, ModuleNotFoundError) and numbers such as ports (8000)
+EXACT_TOKEN = re.compile(r"\b(?:[A-Za-z]+\d+[A-Za-z\d]*|[a-z]+_[a-z_\d]+|[A-Z][a-z]+(?:[A-Z][a-z]+)+|\d{4,5})\b")
+
+
+def load_corpus(conn, db_path):
+    dim = int(read_meta(conn).get("embedding_dim", 0))
+    loaded, _ = open_sidecar(conn, db_path, dim) if dim else (None, None)
+    matrix, row_keys = loaded if loaded is not None else build_matrix(conn, dim or 384)
+
+    texts = {}
+    for table in CHUNK_TABLES:
+        for chunk_id, text in conn.execute(f"SELECT chunk_id, text FROM {table}"):
+            texts[chunk_id] = text
+    chunk_ids = [chunk_id for _, chunk_id in row_keys]
+    return matrix, chunk_ids, [texts[c] for c in chunk_ids]
+
+
+def synthetic_queries(texts, n, seed=0):
+    """Known-item questions built around an exact token from a random chunk.
+
+    A retrieved chunk counts as relevant if it contains the token.
+    """
+    rng = random.Random(seed)
+    queries = []
+    for i in rng.sample(range(len(texts)), len(texts)):
+        matches = list(EXACT_TOKEN.finditer(texts[i]))
+        if not matches:
+            continue
+        match = rng.choice(matches)
+        words = texts[i][max(0, match.start() - 60):match.end() + 60].split()[1:-1]
+        context = " ".join(w for w in words if match.group() not in w)[:80]
+        queries.append({"question": f"{context} {match.group()}?", "token": match.group()})
+        if len(queries) == n:
+            break
+    return queries
+
+
+def evaluate(queries, embeddings, matrix, texts, lexical, k=TOP_K):
+    post_numbers = np.zeros(matrix.shape[0], dtype=np.int64)
+    exact = BruteForceRetriever(matrix)
+    runs = {"vector": [], "bm25": [], "hybrid": []}
+    lexical_ms = []
+
+    for query, q in zip(queries, embeddings):
+        rows, scores = exact.candidate_scores(q)
+        dense, _ = select_top_k(rows, scores, post_numbers, k * 5, SIMILARITY_THRESHOLD)
+
+        start = time.perf_counter()
+        bm25 = lexical.search(query["question"], limit=k * 5)
+        lexical_ms.append((time.perf_counter() - start) * 1000)
+
+        runs["vector"].append(dense[:k])
+        runs["bm25"].append(bm25[:k])
+        runs["hybrid"].append(rrf_fuse([dense, bm25], k)[0])
+
+    def relevant(query, row):
+        if "token" in query:
+            return query["token"] in texts[row]
+        return row in query["rows"]
+
+    report = {}
+    for name, results in runs.items():
+        ranks = [
+            next((r for r, row in enumerate(rows, start=1) if relevant(query, row)), None)
+            for query, rows in zip(queries, results)
+        ]
+        report[name] = {
+            f"recall@{k}": float(np.mean([r is not None for r in ranks])),
+            "mrr": float(np.mean([1 / r if r else 0.0 for r in ranks])),
+        }
+    report["lexical_ms"] = dict(zip(("p50", "p95", "p99"), np.percentile(lexical_ms, [50, 95, 99]).tolist()))
+    return report
+
+
+def main(args):
+    from sentence_transformers import SentenceTransformer
+
+    conn = sqlite3.connect(args.db)
+    if not LexicalIndex.available(conn):
+        raise SystemExit("No FTS index in the knowledge base; rebuild it with base_creation_test.py first.")
+
+    matrix, chunk_ids, texts = load_corpus(conn, args.db)
+    row_of = {chunk_id: i for i, chunk_id in enumerate(chunk_ids)}
+    lexical = LexicalIndex(args.db, row_of)
+
+    if args.queries:
+        # JSON lines: {"question": "...", "chunk_ids": ["...", ...]}
+        with open(args.queries, encoding="utf-8") as f:
+            queries = [json.loads(line) for line in f if line.strip()]
+        for q in queries:
+            q["rows"] = {row_of[c] for c in q["chunk_ids"] if c in row_of}
+    else:
+        queries = synthetic_queries(texts, args.n)
+    if not queries:
+        raise SystemExit("No queries to evaluate.")
+
+    model = SentenceTransformer(MODEL_NAME, device="cpu")
+    embeddings = model.encode([q["question"] for q in queries], convert_to_numpy=True).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    report = evaluate(queries, embeddings, matrix, texts, lexical, k=args.k)
+    print(f"📊 {len(queries)} queries over {matrix.shape[0]} chunks")
+    for name in ("vector", "bm25", "hybrid"):
+        r = report[name]
+        print(f"  {name:<7} recall@{args.k}={r[f'recall@{args.k}']:.3f}  mrr={r['mrr']:.3f}")
+    ms = report["lexical_ms"]
+    print(f"  BM25 lookup: p50={ms['p50']:.2f} ms  p95={ms['p95']:.2f} ms  p99={ms['p99']:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline recall of vector vs BM25 vs hybrid (RRF) retrieval.")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--queries", help="JSON lines with question + relevant chunk_ids (default: synthetic)")
+    parser.add_argument("--n", type=int, default=N_QUERIES, help="synthetic queries")
+    parser.add_argument("-k", type=int, default=TOP_K)
+    main(parser.parse_args())
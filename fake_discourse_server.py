@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from aiohttp import web
+
+# ------------------------------
+# CONFIG
+# ------------------------------
+HOST = "127.0.0.1"
+PORT = 8002
+PAGE_SIZE = 30            # topics per category page, as on Discourse
+CHUNK_SIZE = 20           # posts inlined in /t/{id}.json; the rest only appear in "stream"
+
+
+def iso(dt):
+    return dt.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def synthetic_topics(n_topics=100, posts_per_topic=45, start="2025-01-01", seed=0):
+    """Topic JSON shaped like Discourse's ``/t/{id}.json``, with every post inlined."""
+    rng = random.Random(seed)
+    start_dt = datetime.fromisoformat(start).replace(tzinfo=timezone.utc)
+    topics, post_id = {}, 1000
+    for i in range(n_topics):
+        topic_id = 1 + i
+        created = start_dt + timedelta(hours=i * 12)
+        posts = []
+        for n in range(1, rng.randint(1, posts_per_topic) + 1):
+            post_id += 1
+            posts.append({
+                "id": post_id,
+                "post_number": n,
+                "username": f"user{rng.randint(1, 50)}",
+                "created_at": iso(created + timedelta(minutes=n * 7)),
+                "cooked": f"<p>Post {n} of topic {topic_id}: question about GA{rng.randint(1, 7)}.</p>",
+            })
+        topics[topic_id] = {
+            "id": topic_id,
+            "title": f"Synthetic topic {topic_id}",
+            "created_at": iso(created),
+            "post_stream": {"posts": posts},
+        }
+    return topics
+
+
+def load_fixtures(path):
+    """``topic_*.json`` files as saved by the scraper (or downloaded_threads/)."""
+    topics = {}
+    for name in sorted(os.listdir(path)):
+        if name.endswith(".json"):
+            with open(os.path.join(path, name), encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict) and "post_stream" in data:
+                topics[data["id"]] = data
+    return topics
+
+
+def topic_summary(topic):
+    posts = topic["post_stream"]["posts"]
+    last = posts[-1]["created_at"] if posts else topic["created_at"]
+    return {
+        "id": topic["id"],
+        "title": topic.get("title", ""),
+        "created_at": topic["created_at"],
+        "last_posted_at": last,
+        "bumped_at": topic.get("bumped_at", last),
+        "posts_count": len(posts),
+        "highest_post_number": max((p["post_number"] for p in posts), default=0),
+    }
+
+
+def make_app(topics, latency_ms=20.0, rate_limit=None, retry_after=1, fail_rate=0.0):
+    """An aiohttp app serving ``topics`` through Discourse's JSON routes.
+
+    ``GET /c/{slug}/{id}.json?page=N`` lists topics by latest activity
+    (``bumped_at``) or, with ``order=created``, by creation, newest first;
+    ``/t/{id}.json`` inlines the first CHUNK_SIZE posts plus the full post
+    id ``stream``, and ``/t/{id}/posts.json?post_ids[]=..`` returns the
+    rest. More than ``rate_limit`` requests per second get 429 with
+    ``Retry-After``; ``fail_rate`` of requests get 502. ``GET /stats``
+    counts requests per route. ``topics`` is read on every request, so a
+    caller may add topics or posts between runs.
+    """
+    counters = Counter()
+    window = {"start": time.monotonic(), "count": 0}
+
+    @web.middleware
+    async def limits(request, handler):
+        if request.path == "/stats":
+            return await handler(request)
+        counters["requests"] += 1
+        await asyncio.sleep(latency_ms / 1000)
+
+        if rate_limit:
+            now = time.monotonic()
+            if now - window["start"] >= 1:
+                window["start"], window["count"] = now, 0
+            window["count"] += 1
+            if window["count"] > rate_limit:
+                counters["rate_limited"] += 1
+                return web.json_response(
+                    {"errors": ["You’ve performed this action too many times."], "extras": {"wait_seconds": retry_after}},
+                    status=429, headers={"Retry-After": str(retry_after)},
+                )
+        if random.random() < fail_rate:
+            counters["failed"] += 1
+            return web.json_response({"errors": ["bad gateway"]}, status=502)
+        return await handler(request)
+
+    def ordered(order):
+        key = "created_at" if order == "created" else "bumped_at"
+        return sorted(topics.values(), key=lambda t: topic_summary(t)[key], reverse=True)
+
+    async def category(request):
+        counters["category"] += 1
+        page = int(request.query.get("page", 0))
+        listing = ordered(request.query.get("order"))
+        chunk = listing[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+        topic_list = {"topics": [topic_summary(t) for t in chunk]}
+        if (page + 1) * PAGE_SIZE < len(listing):
+            topic_list["more_topics_url"] = f"{request.path}?page={page + 1}"
+        return web.json_response({"topic_list": topic_list})
+
+    async def topic(request):
+        counters["topic"] += 1
+        data = topics.get(int(request.match_info["topic_id"]))
+        if data is None:
+            raise web.HTTPNotFound()
+        posts = data["post_stream"]["posts"]
+        body = {k: v for k, v in data.items() if k != "post_stream"}
+        body.update(topic_summary(data))
+        body["post_stream"] = {"posts": posts[:CHUNK_SIZE], "stream": [p["id"] for p in posts]}
+        return web.json_response(body)
+
+    async def posts(request):
+        counters["posts"] += 1
+        data = topics.get(int(request.match_info["topic_id"]))
+        if data is None:
+            raise web.HTTPNotFound()
+        wanted = {int(pid) for pid in request.query.getall("post_ids[]", [])}
+        found = [p for p in data["post_stream"]["posts"] if p["id"] in wanted]
+        return web.json_response({"post_stream": {"posts": found}})
+
+    async def stats(request):
+        return web.json_response(dict(counters))
+
+    app = web.Application(middlewares=[limits])
+    app.router.add_get(r"/c/{slug:.+}/{category_id:\d+}.json", category)
+    app.router.add_get(r"/t/{topic_id:\d+}.json", topic)
+    app.router.add_get(r"/t/{topic_id:\d+}/posts.json", posts)
+    app.router.add_get("/stats", stats)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Discourse stand-in serving fixture topic JSON.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--fixtures", help="directory of topic_*.json files (default: synthetic topics)")
+    parser.add_argument("--topics", type=int, default=100, help="synthetic topics")
+    parser.add_argument("--posts", type=int, default=45, help="max posts per synthetic topic")
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--rate-limit", type=int, default=None, help="requests per second before 429s")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests that get 502")
+    args = parser.parse_args()
+
+    topics = load_fixtures(args.fixtures) if args.fixtures else synthetic_topics(args.topics, args.posts)
+    print(f"🚀 Fake Discourse with {len(topics)} topics on http://{args.host}:{args.port}")
+    web.run_app(
+        make_app(topics, args.latency_ms, args.rate_limit, args.retry_after, args.fail_rate),
+        host=args.host, port=args.port, print=None,
+    )
@@ -4,6 +4,8 @@ const CONFIG = {
     API_ENDPOINT: 'https://fit-snake-strangely.ngrok-free.app/query',
     // Fallback to localhost for development
     // API_ENDPOINT: 'http://localhost:8000/query',
+    // Stream answers token by token from `${API_ENDPOINT}/stream` (Server-Sent Events)
+    USE_STREAMING: true,
     MAX_CHAR_COUNT: 2000,
 };
 
@@ -463,6 +465,12 @@ async function handleQuestionSubmit(e) {
             requestBody.image = state.currentImageBase64;
         }
 
+        if (CONFIG.USE_STREAMING) {
+            await streamAnswer(requestBody);
+            saveChatHistory();
+            return;
+        }
+
         // Make API request
         const response = await fetch(CONFIG.API_ENDPOINT, {
             method: 'POST',
@@ -502,6 +510,137 @@ async function handleQuestionSubmit(e) {
     }
 }
 
+// Streaming Answers
+function parseSSEEvent(block) {
+    let event = 'message';
+    const data = [];
+    block.split('\n').forEach(line => {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data.push(line.slice(5).trim());
+    });
+    return { event, data: data.length ? JSON.parse(data.join('\n')) : null };
+}
+
+async function* readSSE(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const block = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            if (block.trim()) yield parseSSEEvent(block);
+        }
+    }
+}
+
+function createStreamingMessage() {
+    const messageDiv = document.createElement('div');
+    messageDiv.className = 'message assistant streaming';
+
+    const avatar = document.createElement('div');
+    avatar.className = 'message-avatar';
+    avatar.textContent = '🎓';
+    messageDiv.appendChild(avatar);
+
+    const content = document.createElement('div');
+    content.className = 'message-content';
+    const body = document.createElement('div');
+    content.appendChild(body);
+    messageDiv.appendChild(content);
+    elements.chatHistory.appendChild(messageDiv);
+
+    let text = '';
+    let renderPending = false;
+
+    const render = () => {
+        renderPending = false;
+        if (typeof marked !== 'undefined' && typeof DOMPurify !== 'undefined') {
+            body.innerHTML = DOMPurify.sanitize(marked.parse(text));
+        } else {
+            body.textContent = text;
+        }
+        scrollToBottom();
+    };
+
+    return {
+        append(delta) {
+            text += delta;
+            // Re-render at most once per frame, however fast tokens arrive
+            if (!renderPending) {
+                renderPending = true;
+                requestAnimationFrame(render);
+            }
+        },
+        showLinks(links) {
+            if (!links || !links.length) return;
+            const linksDiv = document.createElement('div');
+            linksDiv.className = 'message-links';
+            const linksTitle = document.createElement('h4');
+            linksTitle.textContent = '🔎 Retrieved:';
+            linksDiv.appendChild(linksTitle);
+            links.slice(0, 5).forEach(link => {
+                const linkA = document.createElement('a');
+                linkA.className = 'source-link';
+                linkA.href = link.url;
+                linkA.target = '_blank';
+                linkA.rel = 'noopener noreferrer';
+                linkA.textContent = `📄 ${link.text || link.url}`;
+                linksDiv.appendChild(linkA);
+            });
+            content.appendChild(linksDiv);
+        },
+        remove() {
+            messageDiv.remove();
+        },
+    };
+}
+
+async function streamAnswer(requestBody) {
+    const response = await fetch(`${CONFIG.API_ENDPOINT}/stream`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream',
+        },
+        body: JSON.stringify(requestBody),
+    });
+
+    if (!response.ok) {
+        throw new Error(`API Error: ${response.status} ${response.statusText}`);
+    }
+
+    const message = createStreamingMessage();
+    try {
+        for await (const { event, data } of readSSE(response)) {
+            if (event === 'links') {
+                message.showLinks(data);
+            } else if (event === 'token') {
+                hideTypingIndicator();
+                message.append(data.text);
+            } else if (event === 'error') {
+                throw new Error(`API Error: ${data.status} ${data.detail}`);
+            } else if (event === 'done') {
+                // Swap the live message for the final one with parsed sources
+                message.remove();
+                addMessageToChat('assistant', data.answer, null, data.links);
+                showToast('Response received', 'success');
+                return;
+            }
+        }
+        throw new Error('Answer stream ended unexpectedly');
+    } catch (error) {
+        message.remove();
+        throw error;
+    }
+}
+
 // Typing Indicator
 function showTypingIndicator() {
     if (elements.typingIndicator) {
@@ -0,0 +1,150 @@
+import re
+import sqlite3
+import threading
+
+from embedding_store import CHUNK_TABLES
+
+# ------------------------------
+# CONFIG
+# ------------------------------
+FTS_TABLE = "chunks_fts"
+FTS_VOCAB_TABLE = "chunks_fts_vocab"
+
+# Keep snake_case names (image_to_string) as one token; digits are token
+# characters already, so "GA4" and "8000" survive as-is.
+FTS_TOKENIZE = "unicode61 tokenchars '_'"
+
+MAX_QUERY_TERMS = 16
+
+# Terms in more than this share of chunks carry almost no BM25 weight but
+# make FTS5 score most of the corpus, so they are left out of the query
+MAX_DOC_RATIO = 0.05
+
+# BM25 cost grows with the postings scanned; rarest terms are added until
+# their document counts sum past this
+MAX_POSTINGS = 2000
+
+# Frequent question words that would match most of the corpus
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "can", "do", "does", "for", "from",
+    "how", "i", "if", "in", "is", "it", "me", "my", "of", "on", "or", "should", "so", "that",
+    "the", "this", "to", "was", "we", "what", "when", "where", "which", "who", "why", "will",
+    "with", "you", "your",
+}
+
+
+def build_fts(conn):
+    """(Re)build the FTS5 index over the text of every chunk table."""
+    conn.execute(f"DROP TABLE IF EXISTS {FTS_VOCAB_TABLE}")
+    conn.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    conn.execute(f"""
+        CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+            text,
+            source_table UNINDEXED,
+            chunk_id UNINDEXED,
+            tokenize = "{FTS_TOKENIZE}"
+        )
+    """)
+    for table in CHUNK_TABLES:
+        conn.execute(f"""
+            INSERT INTO {FTS_TABLE} (text, source_table, chunk_id)
+            SELECT text, '{table}', chunk_id FROM {table}
+        """)
+    conn.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+    conn.execute(f"CREATE VIRTUAL TABLE {FTS_VOCAB_TABLE} USING fts5vocab({FTS_TABLE}, 'row')")
+
+
+def fts_match_query(text, doc_freq=None, max_docs=None, max_postings=MAX_POSTINGS):
+    """Question → FTS5 MATCH expression: its distinct terms, quoted and OR-ed.
+
+    Quoting keeps user punctuation from being parsed as FTS syntax. With
+    ``doc_freq`` (term → number of chunks), terms found in more than
+    ``max_docs`` chunks or not indexed at all are dropped, and the rarest
+    terms are kept while their chunk counts fit in ``max_postings``.
+    """
+    terms = []
+    for term in re.findall(r"\w+", text.lower()):
+        if term not in STOPWORDS and term not in terms and (len(term) > 1 or term.isdigit()):
+            terms.append(term)
+
+    if doc_freq is not None:
+        rare = sorted((t for t in terms if 0 < doc_freq.get(t, 0) <= max_docs), key=doc_freq.get)
+        terms, postings = [], 0
+        for t in rare:
+            postings += doc_freq[t]
+            if terms and postings > max_postings:
+                break
+            terms.append(t)
+    return " OR ".join(f'"{t}"' for t in terms[:MAX_QUERY_TERMS])
+
+
+class LexicalIndex:
+    """BM25 lookups against the builder's FTS5 table.
+
+    ``row_of`` maps chunk_id → row of the embedding matrix, so hits can be
+    fused with vector results. Each thread gets its own read-only
+    connection, since searches run in the API's retrieval pool. Document
+    frequencies are read once so overly common terms never reach FTS5.
+    """
+
+    def __init__(self, db_path, row_of, max_doc_ratio=MAX_DOC_RATIO):
+        self.db_path = db_path
+        self.row_of = row_of
+        self._local = threading.local()
+
+        conn = self._conn()
+        self.doc_freq = dict(conn.execute(f"SELECT term, doc FROM {FTS_VOCAB_TABLE}"))
+        n_docs = conn.execute(f"SELECT count(*) FROM {FTS_TABLE}").fetchone()[0]
+        self.max_docs = max(1, int(n_docs * max_doc_ratio))
+
+    @staticmethod
+    def available(conn):
+        return conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = ?", (FTS_VOCAB_TABLE,)
+        ).fetchone() is not None
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+            self._local.conn = conn
+        return conn
+
+    def search(self, text, limit=50, mask=None):
+        """Matrix rows of the best BM25 matches, best first.
+
+        With ``mask`` (a bool per matrix row) only rows it allows count
+        toward ``limit``: hits are read past the first ``limit`` until
+        enough match, so a narrow filter still gets its lexical hits.
+        The query's postings are capped anyway, so this stays cheap.
+        """
+        match = fts_match_query(text, self.doc_freq, self.max_docs)
+        if not match:
+            return []
+
+        if mask is None:
+            hits = self._conn().execute(
+                f"SELECT chunk_id FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ? ORDER BY rank LIMIT ?",
+                (match, limit),
+            ).fetchall()
+            return [self.row_of[chunk_id] for (chunk_id,) in hits if chunk_id in self.row_of]
+
+        rows = []
+        hits = self._conn().execute(
+            f"SELECT chunk_id FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ? ORDER BY rank", (match,)
+        )
+        for (chunk_id,) in hits:
+            row = self.row_of.get(chunk_id)
+            if row is not None and mask[row]:
+                rows.append(row)
+                if len(rows) == limit:
+                    break
+        return rows
+
+
+if __name__ == "__main__":
+    # Add the FTS index to an existing knowledge base without rebuilding it
+    conn = sqlite3.connect("knowledge_base.db")
+    with conn:
+        build_fts(conn)
+    print(f"✅ Built {FTS_TABLE}: {conn.execute(f'SELECT count(*) FROM {FTS_TABLE}').fetchone()[0]} chunks")
@@ -0,0 +1,219 @@
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import Counter, deque
+
+import aiohttp
+import numpy as np
+from fastapi import HTTPException
+
+from metrics import record_stage
+
+logger = logging.getLogger("uvicorn.error")
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+LATENCY_WINDOW = 1000
+
+
+class LLMClient:
+    """Chat-completions client sharing one pooled ``aiohttp`` session.
+
+    Create it once per process (the API does so in its lifespan) and call
+    ``start()`` inside the running loop; connections to the LLM host are
+    then kept alive and reused instead of paying DNS/TCP/TLS on every
+    answer. 429/5xx responses and dropped connections are retried with
+    full-jitter exponential backoff, honouring ``Retry-After`` when sent.
+    """
+
+    def __init__(
+        self,
+        base_url,
+        api_key,
+        model,
+        limit_per_host=16,
+        keepalive_timeout=60.0,
+        connect_timeout=5.0,
+        read_timeout=60.0,
+        max_retries=3,
+        backoff_base=0.5,
+        backoff_max=8.0,
+    ):
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.api_key = api_key
+        self.model = model
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(total=None, connect=connect_timeout, sock_read=read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.session = None
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.streams = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retries = 0
+        self.retry_reasons = Counter()
+        self.connections_created = 0
+        self.connections_reused = 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._ttft = deque(maxlen=LATENCY_WINDOW)
+
+    async def start(self):
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_create_end.append(self._on_connection_created)
+        trace.on_connection_reuseconn.append(self._on_connection_reused)
+
+        connector = aiohttp.TCPConnector(
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=300,
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=self.timeout,
+            headers={"Authorization": self.api_key, "Content-Type": "application/json"},
+            trace_configs=[trace],
+        )
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _on_connection_created(self, session, ctx, params):
+        with self._lock:
+            self.connections_created += 1
+
+    async def _on_connection_reused(self, session, ctx, params):
+        with self._lock:
+            self.connections_reused += 1
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        # Full jitter: spreads retries from concurrent requests apart
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def _post(self, payload, start):
+        """POST with retries; returns the open 200 response (the caller releases it)."""
+        if self.session is None:
+            raise RuntimeError("LLMClient.start() has not been called")
+
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                resp = await self.session.post(self.url, json=payload)
+                if resp.status == 200:
+                    return resp
+                async with resp:
+                    error = await resp.text()
+                status = resp.status
+                retry_after = resp.headers.get("Retry-After")
+                reason = str(status)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                status, error, reason = 502, f"LLM connection error: {type(e).__name__}", type(e).__name__
+
+            if status not in RETRY_STATUSES or attempt == self.max_retries:
+                logger.error(error)
+                self._record(start, ok=False)
+                raise HTTPException(status_code=status, detail=error)
+
+            delay = self._backoff(attempt, retry_after)
+            with self._lock:
+                self.retries += 1
+                self.retry_reasons[reason] += 1
+            logger.warning(f"LLM request failed ({reason}), retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    async def chat(self, messages, **params) -> str:
+        """POST one chat completion and return the message content."""
+        payload = {"model": self.model, "messages": messages, **params}
+        with self._lock:
+            self.requests += 1
+        start = time.perf_counter()
+
+        async with await self._post(payload, start) as resp:
+            record_stage("llm_ttfb", time.perf_counter() - start)
+            result = await resp.json()
+        self._record(start, ok=True)
+        return result["choices"][0]["message"]["content"]
+
+    async def chat_stream(self, messages, **params):
+        """Like ``chat`` with ``stream: true``; yields content deltas as they arrive.
+
+        Retries only happen before the response starts: a stream that breaks
+        midway raises rather than replaying tokens the caller already sent.
+        """
+        payload = {"model": self.model, "messages": messages, "stream": True, **params}
+        with self._lock:
+            self.requests += 1
+            self.streams += 1
+        start = time.perf_counter()
+        first = True
+
+        try:
+            async with await self._post(payload, start) as resp:
+                async for raw in resp.content:
+                    line = raw.decode("utf-8").strip()
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+
+                    choices = json.loads(data).get("choices") or [{}]
+                    delta = choices[0].get("delta", {}).get("content")
+                    if delta:
+                        if first:
+                            first = False
+                            ttft = time.perf_counter() - start
+                            with self._lock:
+                                self._ttft.append(ttft * 1000)
+                            record_stage("llm_ttfb", ttft)
+                        yield delta
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self._record(start, ok=False)
+            raise
+        self._record(start, ok=True)
+
+    def _record(self, start, ok):
+        elapsed = time.perf_counter() - start
+        record_stage("llm_total", elapsed)
+        with self._lock:
+            self._latencies.append(elapsed * 1000)
+            if ok:
+                self.succeeded += 1
+            else:
+                self.failed += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = list(self._latencies)
+            ttft = list(self._ttft)
+            stats = {
+                "url": self.url,
+                "requests": self.requests,
+                "streams": self.streams,
+                "succeeded": self.succeeded,
+                "failed": self.failed,
+                "retries": self.retries,
+                "retry_reasons": dict(self.retry_reasons),
+                "connections_created": self.connections_created,
+                "connections_reused": self.connections_reused,
+            }
+        if latencies:
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            stats["latency_ms"] = {"p50": p50, "p95": p95, "p99": p99, "window": len(latencies)}
+        if ttft:
+            p50, p95, p99 = np.percentile(ttft, [50, 95, 99])
+            stats["first_token_ms"] = {"p50": p50, "p95": p95, "p99": p99, "window": len(ttft)}
+        return stats
@@ -0,0 +1,136 @@
+import time
+import base64
+import asyncio
+import argparse
+import functools
+import itertools
+from io import BytesIO
+
+import aiohttp
+import numpy as np
+from PIL import Image, ImageDraw
+
+# ------------------------------
+# CONFIG
+# ------------------------------
+API_URL = "http://localhost:8000/query"
+
+TEXT_QUESTIONS = [
+    "What is the deadline for GA4?",
+    "How do I run a FastAPI app with uvicorn?",
+    "Which port does the course Docker image expose?",
+    "How is the project 1 score calculated?",
+]
+
+# Repeated questions hit the answer cache after the first round, so the
+# text-only latency measured here is OCR/embedding/retrieval contention,
+# not LLM time. Every image request sends a distinct image, since OCR
+# results are cached by content hash.
+
+
+@functools.lru_cache(maxsize=None)
+def base_image(width, height):
+    img = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(img)
+    for i in range(30):
+        draw.text((20, 20 + i * 28), f"Traceback line {i}: ModuleNotFoundError: No module named 'x{i}'", fill=0)
+    return img
+
+
+def make_image_b64(width=1600, height=900, label=0):
+    """A screenshot-sized image with some text for Tesseract to chew on; ``label`` makes it unique."""
+    img = base_image(width, height).copy()
+    ImageDraw.Draw(img).text((20, 4), f"Request {label}", fill=0)
+    buf = BytesIO()
+    # Fast compression keeps per-request image generation cheap on the client
+    img.save(buf, format="PNG", compress_level=1)
+    return base64.b64encode(buf.getvalue()).decode()
+
+
+async def worker(session, url, next_payload, stop_at, latencies, errors):
+    """``next_payload`` is an async callable; building a payload is not timed."""
+    while time.perf_counter() < stop_at:
+        payload = await next_payload()
+        start = time.perf_counter()
+        try:
+            async with session.post(url, json=payload) as resp:
+                await resp.read()
+                if resp.status != 200:
+                    errors.append(resp.status)
+                    continue
+        except Exception as e:
+            errors.append(type(e).__name__)
+            continue
+        latencies.append((time.perf_counter() - start) * 1000)
+
+
+def summarize(name, latencies, errors):
+    if not latencies:
+        print(f"{name:<22} no successful requests ({len(errors)} errors)")
+        return
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    print(
+        f"{name:<22} n={len(latencies):<5} p50={p50:7.1f} ms  p95={p95:7.1f} ms  "
+        f"p99={p99:7.1f} ms  errors={len(errors)}"
+    )
+
+
+_text_questions = itertools.cycle(TEXT_QUESTIONS)
+_image_ids = itertools.count()
+
+
+async def next_text_payload():
+    return {"question": next(_text_questions)}
+
+
+async def next_image_payload():
+    # PNG encoding takes tens of ms, so keep it off the client's event loop
+    image_b64 = await asyncio.to_thread(make_image_b64, label=next(_image_ids))
+    return {"question": "What does this error mean?", "image": image_b64}
+
+
+async def run_phase(url, text_concurrency, image_concurrency, duration):
+
+    text_lat, text_err, img_lat, img_err = [], [], [], []
+    stop_at = time.perf_counter() + duration
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=120)) as session:
+        tasks = [
+            worker(session, url, next_text_payload, stop_at, text_lat, text_err)
+            for _ in range(text_concurrency)
+        ] + [
+            worker(session, url, next_image_payload, stop_at, img_lat, img_err)
+            for _ in range(image_concurrency)
+        ]
+        await asyncio.gather(*tasks)
+
+    return text_lat, text_err, img_lat, img_err
+
+
+async def main(args):
+    print(f"🔥 Warming up answer cache against {args.url} ...")
+    await run_phase(args.url, len(TEXT_QUESTIONS), 1, 5)
+
+    print(f"\n▶ Phase A: {args.concurrency} text-only clients for {args.duration}s")
+    text_lat, text_err, _, _ = await run_phase(args.url, args.concurrency, 0, args.duration)
+    summarize("text only", text_lat, text_err)
+
+    print(f"\n▶ Phase B: same text load + {args.image_concurrency} image clients")
+    text_lat_b, text_err_b, img_lat, img_err = await run_phase(
+        args.url, args.concurrency, args.image_concurrency, args.duration
+    )
+    summarize("text (with images)", text_lat_b, text_err_b)
+    summarize("image", img_lat, img_err)
+
+    if text_lat and text_lat_b:
+        ratio = np.percentile(text_lat_b, 99) / np.percentile(text_lat, 99)
+        print(f"\ntext-only p99 ratio B/A: {ratio:.2f}x (≈1 means image OCR no longer stalls the loop)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Text-query latency under concurrent image (OCR) load.")
+    parser.add_argument("--url", default=API_URL)
+    parser.add_argument("--concurrency", type=int, default=8, help="text-only clients")
+    parser.add_argument("--image-concurrency", type=int, default=4, help="image clients in phase B")
+    parser.add_argument("--duration", type=float, default=20, help="seconds per phase")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,162 @@
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# ------------------------------
+# CONFIG
+# ------------------------------
+PREFIX = "virtual_ta"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = f"{PREFIX}_{name}_total"
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = f"{PREFIX}_{name}"
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}   # labels → [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_labels(names, key + (bound,))} {count}")
+                lines.append(f"{self.name}_bucket{_labels(names, key + ('+Inf',))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    """Metrics plus collector callbacks, rendered in Prometheus text format.
+
+    A collector returns ``[(name, type, help, [(labels_dict, value), ...])]``
+    at scrape time; it is how existing ``stats()`` counters (caches, pools,
+    LLM client) are exported without instrumenting them twice.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        for collector in self.collectors:
+            for name, kind, help, samples in collector():
+                name = f"{PREFIX}_{name}"
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "stage_seconds", "Time spent per request stage.", ["stage"]
+))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "request_seconds", "End-to-end HTTP request time.", ["path"]
+))
+RESPONSES = REGISTRY.register(Counter(
+    "responses", "HTTP responses by path and status code.", ["path", "status"]
+))
+ERRORS = REGISTRY.register(Counter(
+    "errors", "Errors by path and class (exception name or HTTP status).", ["path", "error"]
+))
+CHUNKS = REGISTRY.register(Counter(
+    "chunks", "Chunks retrieved and kept in prompts.", ["kind"]
+))
+PROMPT_TOKENS = REGISTRY.register(Counter(
+    "prompt_tokens", "Prompt tokens sent to the LLM."
+))
+
+
+# -----------------------------
+# Per-request Timings
+# -----------------------------
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def start_request_timings() -> dict:
+    """Collect this request's stage timings (seconds) into the returned dict."""
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def record_stage(name, seconds):
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name):
+    """Time a block (sync or around an ``await``) as one request stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def server_timing(timings) -> str:
+    """``Server-Timing`` header value (durations in ms), visible in browser dev tools."""
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
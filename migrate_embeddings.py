@@ -0,0 +1,61 @@
+import sqlite3
+import logging
+
+from embedding_store import CHUNK_TABLES, decode_embedding, encode_embedding, write_embedding_meta, write_sidecar
+
+# === Logging Setup ===
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
+logger = logging.getLogger(__name__)
+
+DB_PATH = "knowledge_base.db"
+BATCH = 1000
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+def migrate_table(conn, table):
+    """Rewrite JSON-text embeddings of one table as float32 blobs."""
+    rows = conn.execute(
+        f"SELECT chunk_id, embedding FROM {table} WHERE typeof(embedding) = 'text'"
+    ).fetchall()
+    logger.info(f"{table}: {len(rows)} JSON embeddings to convert")
+
+    dim = None
+    for i in range(0, len(rows), BATCH):
+        updates = []
+        for chunk_id, emb_json in rows[i:i + BATCH]:
+            emb = decode_embedding(emb_json)
+            dim = dim or len(emb)
+            updates.append((encode_embedding(emb), chunk_id))
+
+        conn.executemany(f"UPDATE {table} SET embedding = ? WHERE chunk_id = ?", updates)
+        conn.commit()
+
+    return dim
+
+
+def migrate_embeddings(db_path=DB_PATH):
+    conn = sqlite3.connect(db_path)
+
+    dim = None
+    for table in CHUNK_TABLES:
+        dim = migrate_table(conn, table) or dim
+
+    if dim is None:
+        row = conn.execute(
+            f"SELECT embedding FROM {CHUNK_TABLES[0]} WHERE embedding IS NOT NULL LIMIT 1"
+        ).fetchone()
+        dim = len(decode_embedding(row[0])) if row else 0
+
+    write_embedding_meta(conn, dim, MODEL_NAME)
+    conn.commit()
+
+    # Reclaim the space freed by the shorter blobs
+    conn.execute("VACUUM")
+
+    write_sidecar(conn, db_path, dim)
+    conn.close()
+    logger.info(f"🎉 Migration complete (dim={dim})")
+
+
+if __name__ == "__main__":
+    migrate_embeddings()
@@ -0,0 +1,228 @@
+import time
+import base64
+import hashlib
+import binascii
+import logging
+import threading
+import multiprocessing as mp
+from io import BytesIO
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageOps
+from fastapi import HTTPException
+
+from metrics import record_stage
+
+logger = logging.getLogger("uvicorn.error")
+
+# ------------------------------
+# CONFIG
+# ------------------------------
+MAX_IMAGE_BYTES = 8 * 1024 * 1024     # decoded upload size limit
+MAX_IMAGE_PIXELS = 40_000_000         # decompression-bomb guard for Pillow
+OCR_MAX_SIDE = 2000                   # longer side is scaled down to this
+OCR_MIN_SIDE = 1000                   # small screenshots are scaled up to this
+TIMING_WINDOW = 1000
+
+STAGES = ("decode", "preprocess", "ocr")
+
+
+def decode_image_payload(image_base64: str, max_bytes=MAX_IMAGE_BYTES, max_pixels=MAX_IMAGE_PIXELS) -> bytes:
+    """Base64 → bytes, rejecting oversized uploads before decoding them.
+
+    The pixel count is checked from the image header, before any pixel
+    data is loaded: Pillow only warns between 1x and 2x MAX_IMAGE_PIXELS.
+    """
+    if image_base64.startswith("data:"):
+        image_base64 = image_base64.split(",", 1)[-1]
+
+    # 4 base64 characters carry 3 bytes
+    if len(image_base64) * 3 // 4 > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Image larger than {max_bytes / (1024 * 1024):g} MB")
+    image_bytes = base64.b64decode(image_base64)
+
+    too_large = HTTPException(status_code=413, detail=f"Image larger than {max_pixels / 1e6:g} megapixels")
+    try:
+        with Image.open(BytesIO(image_bytes)) as image:
+            width, height = image.size
+    except Image.DecompressionBombError:
+        raise too_large
+    if width * height > max_pixels:
+        raise too_large
+    return image_bytes
+
+
+def otsu_threshold(gray: np.ndarray) -> int:
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    weights = np.cumsum(hist)
+    means = np.cumsum(hist * np.arange(256))
+    total, total_mean = weights[-1], means[-1]
+
+    background = weights[:-1]
+    foreground = total - background
+    valid = (background > 0) & (foreground > 0)
+    between = np.zeros(255)
+    between[valid] = (
+        (total_mean * background[valid] - means[:-1][valid] * total) ** 2
+        / (background[valid] * foreground[valid])
+    )
+    return int(np.argmax(between))
+
+
+def preprocess_image(image: Image.Image, max_side=OCR_MAX_SIDE, min_side=OCR_MIN_SIDE, binarize=True) -> Image.Image:
+    """Grayscale, scale to an OCR-friendly size and (optionally) binarize with Otsu."""
+    image = ImageOps.exif_transpose(image).convert("L")
+
+    longest = max(image.size)
+    if longest > max_side:
+        scale = max_side / longest
+    elif longest < min_side:
+        scale = min(min_side / longest, 3.0)
+    else:
+        scale = 1.0
+    if scale != 1.0:
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, Image.LANCZOS)
+
+    if binarize:
+        gray = np.asarray(image)
+        image = Image.fromarray(np.where(gray > otsu_threshold(gray), 255, 0).astype(np.uint8)).convert("1")
+    return image
+
+
+def ocr_worker(image_bytes: bytes, max_side=OCR_MAX_SIDE, binarize=True):
+    """Runs in an OCR process: decode, preprocess, Tesseract; returns ``(text, timings_ms)``."""
+    import pytesseract
+
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    start = time.perf_counter()
+    image = Image.open(BytesIO(image_bytes))
+    image.load()
+    decoded = time.perf_counter()
+    image = preprocess_image(image, max_side=max_side, binarize=binarize)
+    prepared = time.perf_counter()
+    text = pytesseract.image_to_string(image).strip()
+    done = time.perf_counter()
+    return text, {
+        "decode": (decoded - start) * 1000,
+        "preprocess": (prepared - decoded) * 1000,
+        "ocr": (done - prepared) * 1000,
+    }
+
+
+class OCRService:
+    """Image → text with a content-hash cache and a bounded process pool.
+
+    ``extract`` is meant to run in the API's OCR StagePool, which bounds
+    the queue; the decode/hash step happens there and cache misses are
+    handed to ``workers`` processes for preprocessing and Tesseract.
+    Students re-upload the same screenshot, so results are cached by the
+    SHA-256 of the decoded bytes.
+    """
+
+    def __init__(self, workers=2, cache_size=256, max_bytes=MAX_IMAGE_BYTES, max_side=OCR_MAX_SIDE, binarize=True):
+        self.workers = workers
+        self.cache_size = cache_size
+        self.max_bytes = max_bytes
+        self.max_side = max_side
+        self.binarize = binarize
+        self._executor = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self._timings = {stage: deque(maxlen=TIMING_WINDOW) for stage in STAGES}
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: never fork the API process with the model loaded
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=mp.get_context("spawn"))
+            return self._executor
+
+    def extract(self, image_base64: str) -> str:
+        start = time.perf_counter()
+        try:
+            image_bytes = decode_image_payload(image_base64, self.max_bytes)
+        except (binascii.Error, ValueError, OSError) as e:
+            logger.warning(f"Failed to decode image: {e}")
+            return ""
+        key = hashlib.sha256(image_bytes).hexdigest()
+        b64_ms = (time.perf_counter() - start) * 1000
+
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                self._timings["decode"].append(b64_ms)
+                text = self._cache[key]
+                record_stage("decode", b64_ms / 1000)
+                return text
+            self.misses += 1
+
+        try:
+            text, timings = self._pool().submit(ocr_worker, image_bytes, self.max_side, self.binarize).result()
+        except Exception as e:
+            with self._lock:
+                self.failures += 1
+            logger.warning(f"Failed to extract text from image: {e}")
+            return ""
+
+        timings["decode"] += b64_ms
+        with self._lock:
+            for stage, ms in timings.items():
+                self._timings[stage].append(ms)
+            self._cache[key] = text
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        for stage, ms in timings.items():
+            record_stage(stage, ms / 1000)
+
+        logger.info(f"OCR extracted text: '{text[:80]}...' ({len(text)} chars)")
+        return text
+
+    def stats(self) -> dict:
+        with self._lock:
+            timings = {stage: list(values) for stage, values in self._timings.items()}
+            stats = {
+                "workers": self.workers,
+                "cache_size": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses,
+                "failures": self.failures,
+            }
+        stats["stage_ms"] = {
+            stage: dict(zip(("p50", "p95", "p99"), np.percentile(values, [50, 95, 99])), n=len(values))
+            for stage, values in timings.items() if values
+        }
+        return stats
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    # Cache self-check: the first extract of an image is a miss that fills
+    # the cache, the second is a hit served from it. Needs Tesseract.
+    from PIL import ImageDraw
+
+    img = Image.new("RGB", (800, 200), "white")
+    ImageDraw.Draw(img).text((20, 80), f"OCR cache check {time.time()}", fill="black")
+    buf = BytesIO()
+    img.save(buf, format="PNG")
+    payload = base64.b64encode(buf.getvalue()).decode()
+
+    service = OCRService(workers=1)
+    try:
+        first = service.extract(payload)
+        assert (service.misses, service.hits, service.failures) == (1, 0, 0), service.stats()
+        second = service.extract(payload)
+        assert (service.misses, service.hits) == (1, 1) and second == first, service.stats()
+        print(f"✅ OCR cache: miss then hit ({first!r})")
+    finally:
+        service.shutdown()
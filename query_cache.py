@@ -0,0 +1,264 @@
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from embedding_store import EMBEDDING_DTYPE, encode_embedding
+
+
+def normalize_question(text: str) -> str:
+    """Cache key for a question: whitespace collapsed, case folded.
+
+    MiniLM lower-cases its input anyway, so questions that differ only in
+    case or spacing map to (effectively) the same embedding.
+    """
+    return " ".join((text or "").split()).casefold()
+
+
+# -----------------------------
+# Query Embedding Cache
+# -----------------------------
+class EmbeddingCache:
+    """Bounded LRU of query embeddings with an optional SQLite layer.
+
+    The in-memory LRU is per process. When ``path`` is given, entries are
+    also written to a small SQLite file so they survive restarts and are
+    shared by every worker pointing at the same file.
+    """
+
+    def __init__(self, maxsize=1024, path=None, disk_maxsize=100_000, namespace=""):
+        self.maxsize = maxsize
+        self.disk_maxsize = disk_maxsize
+        self.namespace = namespace
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._puts = 0
+
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._touched = {}       # key → last disk read, flushed with the next put
+        if path:
+            self._db = sqlite3.connect(path, timeout=5, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS query_embeddings (
+                    key TEXT PRIMARY KEY,
+                    embedding BLOB,
+                    last_used REAL
+                )
+            """)
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_query_embeddings_last_used ON query_embeddings (last_used)"
+            )
+            self._db.commit()
+
+    def _key(self, text):
+        return f"{self.namespace}\x00{normalize_question(text)}"
+
+    def _remember(self, key, emb):
+        self._entries[key] = emb
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def peek(self, text):
+        """In-memory lookup only: never touches SQLite, and a miss isn't counted."""
+        key = self._key(text)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        return None
+
+    def get(self, text):
+        key = self._key(text)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        if self._db is not None:
+            # SQLite work happens under its own lock, so peek()/stats() never wait on disk
+            with self._db_lock:
+                row = self._db.execute(
+                    "SELECT embedding FROM query_embeddings WHERE key = ?", (key,)
+                ).fetchone()
+                if row:
+                    # last_used is written with the next put's commit, not per read
+                    self._touched[key] = time.time()
+            if row:
+                emb = np.frombuffer(row[0], dtype=EMBEDDING_DTYPE)
+                with self._lock:
+                    self._remember(key, emb)
+                    self.disk_hits += 1
+                return emb
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, text, emb):
+        key = self._key(text)
+        emb = np.asarray(emb, dtype=EMBEDDING_DTYPE)
+        with self._lock:
+            self._remember(key, emb)
+
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (key, embedding, last_used) VALUES (?, ?, ?)",
+                    (key, encode_embedding(emb), time.time()),
+                )
+                if self._touched:
+                    self._db.executemany(
+                        "UPDATE query_embeddings SET last_used = ? WHERE key = ?",
+                        [(t, k) for k, t in self._touched.items()],
+                    )
+                    self._touched.clear()
+                self._puts += 1
+                if self._puts % 100 == 0:
+                    # Trim the least recently used rows beyond the disk limit
+                    self._db.execute(
+                        """DELETE FROM query_embeddings WHERE key IN (
+                               SELECT key FROM query_embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                           )""",
+                        (self.disk_maxsize,),
+                    )
+                self._db.commit()
+        return emb
+
+    def get_or_compute(self, text, compute):
+        emb = self.get(text)
+        if emb is None:
+            emb = self.put(text, compute(text))
+        return emb
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# -----------------------------
+# LLM Answer Cache
+# -----------------------------
+def answer_cache_key(question, extracted_text, chunk_ids, model="") -> str:
+    """Hash of everything that reaches the LLM: question, OCR text, context ids, model."""
+    payload = json.dumps(
+        [normalize_question(question), extracted_text or "", list(chunk_ids), model],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """SQLite-backed cache of raw LLM answers, shared by every worker.
+
+    Entries expire after ``ttl`` seconds and the table is trimmed to
+    ``maxsize`` rows by last use. Each row records the knowledge base
+    ``build_id`` it was produced from; rows from any other build are
+    purged on open and never returned.
+    """
+
+    def __init__(self, path, build_id, ttl=86400, maxsize=10_000):
+        self.build_id = build_id or ""
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._puts = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+        self._db = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS llm_answers (
+                key TEXT PRIMARY KEY,
+                build_id TEXT,
+                answer TEXT,
+                created_at REAL,
+                last_used REAL
+            )
+        """)
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_llm_answers_last_used ON llm_answers (last_used)"
+        )
+        self._db.execute("DELETE FROM llm_answers WHERE build_id != ?", (self.build_id,))
+        self._db.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT answer, created_at FROM llm_answers WHERE key = ? AND build_id = ?",
+                (key, self.build_id),
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            answer, created_at = row
+            if self.ttl and now - created_at > self.ttl:
+                self._db.execute("DELETE FROM llm_answers WHERE key = ?", (key,))
+                self._db.commit()
+                self.expired += 1
+                self.misses += 1
+                return None
+
+            self._db.execute("UPDATE llm_answers SET last_used = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+            return answer
+
+    def put(self, key, answer):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                """INSERT OR REPLACE INTO llm_answers (key, build_id, answer, created_at, last_used)
+                   VALUES (?, ?, ?, ?, ?)""",
+                (key, self.build_id, answer, now, now),
+            )
+            self._puts += 1
+            if self._puts % 100 == 0:
+                if self.ttl:
+                    self._db.execute("DELETE FROM llm_answers WHERE created_at < ?", (now - self.ttl,))
+                self._db.execute(
+                    """DELETE FROM llm_answers WHERE key IN (
+                           SELECT key FROM llm_answers ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                       )""",
+                    (self.maxsize,),
+                )
+            self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._db.execute("SELECT COUNT(*) FROM llm_answers").fetchone()[0]
+            return {
+                "size": size,
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+            }
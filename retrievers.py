@@ -0,0 +1,484 @@
+import os
+import time
+import sqlite3
+import numpy as np
+
+from embedding_store import open_sidecar, read_meta
+
+# === Config ===
+IVF_NPROBE = 8            # lists scanned per query: higher = better recall, slower
+KMEANS_ITERS = 20
+KMEANS_TRAIN_PER_LIST = 64
+ASSIGN_TILE = 65536       # rows per matrix product while assigning lists
+QUERY_TILE = 256          # queries scored together in batch search
+CORPUS_TILE = 8192        # corpus rows per matrix-matrix product in batch search
+RRF_K = 60                # reciprocal rank fusion damping: higher = flatter
+QUANT_DTYPES = ("int8", "float16")
+QUANT_CANDIDATES = 200    # first-pass rows re-scored at full precision per query
+QUANT_TILE = 1024         # rows dequantized per product; small enough to stay in cache
+DENSE_MASK_RATIO = 0.25   # filters keeping more rows than this score every row and mask the scores
+
+
+# -----------------------------
+# Shared Ranking
+# -----------------------------
+def select_top_k(rows, scores, post_numbers, top_k, threshold):
+    """Threshold and order candidate rows like the original linear scan.
+
+    Order is similarity desc, then post_number desc, then row order. Rows
+    tied with the k-th score are kept until the final sort so the cut is
+    exact.
+    """
+    keep = scores >= threshold
+    rows, scores = rows[keep], scores[keep]
+
+    if len(rows) > top_k:
+        top = np.argpartition(scores, -top_k)[-top_k:]
+        keep = scores >= scores[top].min()
+        rows, scores = rows[keep], scores[keep]
+
+    order = np.lexsort((rows, -post_numbers[rows], -scores))[:top_k]
+    return rows[order], scores[order]
+
+
+def rrf_fuse(rankings, top_k, k=RRF_K):
+    """Reciprocal rank fusion of several best-first row lists.
+
+    Each row scores ``sum(1 / (k + rank))`` over the lists it appears in
+    (rank from 1), so a row ranked well by both BM25 and cosine beats one
+    ranked first by only one of them. Ties keep the earlier list's order.
+    Returns ``(rows, fused_scores)``, best first.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            fused[int(row)] = fused.get(int(row), 0.0) + 1.0 / (k + rank)
+
+    # dicts keep first-seen order, and sorted() is stable
+    ranked = sorted(fused.items(), key=lambda item: -item[1])[:top_k]
+    rows = np.array([row for row, _ in ranked], dtype=np.int64)
+    scores = np.array([score for _, score in ranked], dtype=np.float32)
+    return rows, scores
+
+
+def mask_rows(mask, n):
+    """Rows allowed by ``mask``, or None when it is dense enough to scan every row."""
+    rows = np.flatnonzero(mask)
+    return None if len(rows) > DENSE_MASK_RATIO * n else rows
+
+
+def batch_top_k(matrix, queries, post_numbers, top_k, threshold, mask=None,
+                query_tile=QUERY_TILE, corpus_tile=CORPUS_TILE):
+    """Exact top-k for many normalised queries with tiled matrix-matrix products.
+
+    Each (query tile x corpus tile) score block is thresholded and cut per
+    row at its k-th best score (ties kept) with one vectorised partition.
+    The survivors are merged into the running per-query top-k using the same
+    (similarity desc, post_number desc, row asc) order as select_top_k.
+    Peak memory is O(query_tile * corpus_tile), whatever the batch or corpus
+    size. With a boolean ``mask``, a dense one masks each tile's scores and
+    a sparse one is scored in tiles of gathered rows, so the filtered slice
+    is never copied whole. Returns ``(rows, scores)`` of shape
+    ``(len(queries), top_k)``; unused slots have row -1.
+    """
+    if top_k <= 0:
+        raise ValueError(f"top_k must be positive, got {top_k}")
+    subset = None if mask is None else mask_rows(mask, matrix.shape[0])
+    n = matrix.shape[0] if subset is None else len(subset)
+    all_rows = np.full((len(queries), top_k), -1, dtype=np.int64)
+    all_scores = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+
+    for q0 in range(0, len(queries), query_tile):
+        q = np.asarray(queries[q0:q0 + query_tile], dtype=np.float32)
+
+        # Running top-k as flat (query, row, score) triples
+        best_q = np.empty(0, dtype=np.int64)
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+
+        for c0 in range(0, n, corpus_tile):
+            if subset is None:
+                tile_rows = np.arange(c0, min(c0 + corpus_tile, n))
+                scores = q @ np.asarray(matrix[c0:c0 + corpus_tile]).T
+            else:
+                tile_rows = subset[c0:c0 + corpus_tile]
+                scores = q @ matrix[tile_rows].T
+            keep = scores >= threshold
+            if mask is not None and subset is None:
+                allowed = mask[c0:c0 + corpus_tile]
+                scores[:, ~allowed] = -np.inf
+                keep &= allowed
+
+            if scores.shape[1] > top_k:
+                kth = np.partition(scores, scores.shape[1] - top_k, axis=1)[:, scores.shape[1] - top_k]
+                keep &= scores >= kth[:, None]
+
+            qi, ci = np.nonzero(keep)
+            best_q = np.concatenate([best_q, qi])
+            best_rows = np.concatenate([best_rows, tile_rows[ci]])
+            best_scores = np.concatenate([best_scores, scores[qi, ci]])
+
+            # Sort by query, then ranking order; keep the first top_k per query
+            order = np.lexsort((best_rows, -post_numbers[best_rows], -best_scores, best_q))
+            best_q, best_rows, best_scores = best_q[order], best_rows[order], best_scores[order]
+            group_start = np.searchsorted(best_q, best_q, side="left")
+            rank = np.arange(len(best_q)) - group_start
+            keep = rank < top_k
+            best_q, best_rows, best_scores = best_q[keep], best_rows[keep], best_scores[keep]
+
+        rank = np.arange(len(best_q)) - np.searchsorted(best_q, best_q, side="left")
+        all_rows[q0 + best_q, rank] = best_rows
+        all_scores[q0 + best_q, rank] = best_scores
+
+    return all_rows, all_scores
+
+
+# -----------------------------
+# Exact Backend
+# -----------------------------
+class BruteForceRetriever:
+    """Scores every row: one matrix-vector product over the whole corpus."""
+
+    name = "exact"
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    def candidate_scores(self, q, mask=None):
+        """Scores of all rows, or only those where the boolean ``mask`` is set.
+
+        A dense mask scores every row and picks the allowed scores; a sparse
+        one gathers its rows CORPUS_TILE at a time, so the memmap is never
+        copied as one filtered slice.
+        """
+        if mask is None:
+            return np.arange(self.matrix.shape[0]), self.matrix @ q
+        rows = mask_rows(mask, self.matrix.shape[0])
+        if rows is None:
+            return np.flatnonzero(mask), (self.matrix @ q)[mask]
+
+        scores = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), CORPUS_TILE):
+            scores[start:start + CORPUS_TILE] = self.matrix[rows[start:start + CORPUS_TILE]] @ q
+        return rows, scores
+
+    def search_batch(self, queries, post_numbers, top_k, threshold, mask=None):
+        return batch_top_k(self.matrix, queries, post_numbers, top_k, threshold, mask)
+
+
+# -----------------------------
+# Approximate Backend (IVF)
+# -----------------------------
+class IVFRetriever:
+    """Inverted-file index: k-means lists, only the ``nprobe`` closest are scanned.
+
+    ``list_rows[list_offsets[c]:list_offsets[c + 1]]`` are the matrix rows
+    assigned to centroid ``c``.
+    """
+
+    name = "ivf"
+
+    def __init__(self, matrix, centroids, list_offsets, list_rows, nprobe=IVF_NPROBE):
+        self.matrix = matrix
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+        self.nprobe = nprobe
+
+    def candidate_scores(self, q, mask=None):
+        """Scores of the rows in the probed lists, restricted to ``mask`` if given.
+
+        When a filter leaves fewer rows than the probed lists hold, the
+        filtered rows are all scored instead: cheaper, and exact.
+        """
+        nprobe = min(self.nprobe, len(self.centroids))
+        probe = np.argpartition(self.centroids @ q, -nprobe)[-nprobe:]
+
+        rows = np.concatenate([
+            self.list_rows[self.list_offsets[c]:self.list_offsets[c + 1]] for c in probe
+        ])
+        if mask is not None:
+            subset = np.flatnonzero(mask)
+            rows = subset if len(subset) <= len(rows) else rows[mask[rows]]
+        return rows, self.matrix[rows] @ q
+
+    def search_batch(self, queries, post_numbers, top_k, threshold, mask=None):
+        """Per-query probing; lists differ per query so there is no shared product."""
+        all_rows = np.full((len(queries), top_k), -1, dtype=np.int64)
+        all_scores = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+        for i, q in enumerate(queries):
+            rows, scores = select_top_k(*self.candidate_scores(q, mask), post_numbers, top_k, threshold)
+            all_rows[i, :len(rows)] = rows
+            all_scores[i, :len(rows)] = scores
+        return all_rows, all_scores
+
+
+# -----------------------------
+# Quantized Backend
+# -----------------------------
+def quantize(matrix, dtype):
+    """``(codes, scales)`` for ``matrix``: float16 copies, or int8 with one scale per row.
+
+    int8 rows are scaled so their largest component maps to 127, which
+    keeps the rounding error relative to each vector rather than to the
+    whole corpus. ``scales`` is None for float16.
+    """
+    if dtype == "float16":
+        return np.asarray(matrix, dtype=np.float16), None
+    if dtype != "int8":
+        raise ValueError(f"unknown quantization {dtype!r}")
+
+    codes = np.empty(matrix.shape, dtype=np.int8)
+    scales = np.empty(matrix.shape[0], dtype=np.float32)
+    for start in range(0, matrix.shape[0], QUANT_TILE):
+        block = np.asarray(matrix[start:start + QUANT_TILE], dtype=np.float32)
+        scale = np.abs(block).max(axis=1) / 127
+        scale[scale == 0] = 1.0
+        codes[start:start + len(block)] = np.round(block / scale[:, None])
+        scales[start:start + len(block)] = scale
+    return codes, scales
+
+
+class QuantizedRetriever:
+    """First pass over an int8/float16 copy, then exact float32 re-scoring.
+
+    The first pass dequantizes ``QUANT_TILE`` rows at a time into a
+    cache-sized buffer, so only the compact codes are read for every
+    query; ``matrix`` (the float32 memmap) is touched just for the
+    ``candidates`` best rows, whose exact scores are what gets
+    thresholded and ranked.
+    """
+
+    def __init__(self, matrix, codes, scales=None, candidates=QUANT_CANDIDATES):
+        self.matrix = matrix
+        self.codes = codes
+        self.scales = scales
+        self.candidates = candidates
+        self.name = str(codes.dtype)
+
+    def approximate_scores(self, q, rows=None):
+        q = np.asarray(q, dtype=np.float32)
+        n = self.codes.shape[0] if rows is None else len(rows)
+        scores = np.empty(n, dtype=np.float32)
+        buffer = np.empty((QUANT_TILE, self.codes.shape[1]), dtype=np.float32)
+        for start in range(0, n, QUANT_TILE):
+            idx = slice(start, start + QUANT_TILE) if rows is None else rows[start:start + QUANT_TILE]
+            block = buffer[:min(QUANT_TILE, n - start)]
+            np.copyto(block, self.codes[idx], casting="unsafe")
+            np.dot(block, q, out=scores[start:start + len(block)])
+        if self.scales is not None:
+            scores *= self.scales if rows is None else self.scales[rows]
+        return scores
+
+    def candidate_scores(self, q, mask=None):
+        """Exact scores of the best first-pass rows (among ``mask`` rows if given)."""
+        rows = None if mask is None else np.flatnonzero(mask)
+        approx = self.approximate_scores(q, rows)
+        if len(approx) > self.candidates:
+            top = np.argpartition(approx, -self.candidates)[-self.candidates:]
+            # Sorted rows keep memmap reads sequential-ish and ties in row order
+            top.sort()
+        else:
+            top = np.arange(len(approx))
+        rows = top if rows is None else rows[top]
+        return rows, np.asarray(self.matrix[rows]) @ q
+
+    def search_batch(self, queries, post_numbers, top_k, threshold, mask=None):
+        all_rows = np.full((len(queries), top_k), -1, dtype=np.int64)
+        all_scores = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+        for i, q in enumerate(queries):
+            rows, scores = select_top_k(*self.candidate_scores(q, mask), post_numbers, top_k, threshold)
+            all_rows[i, :len(rows)] = rows
+            all_scores[i, :len(rows)] = scores
+        return all_rows, all_scores
+
+
+def quant_paths(db_path, dtype):
+    """Memmappable codes (``.int8.npy``) plus build id / scales (``.int8.npz``)."""
+    base = f"{os.path.splitext(db_path)[0]}.{dtype}"
+    return f"{base}.npy", f"{base}.npz"
+
+
+def save_quantized(db_path, dtype, build_id, matrix):
+    codes, scales = quantize(matrix, dtype)
+    codes_path, meta_path = quant_paths(db_path, dtype)
+    np.save(codes_path + ".tmp.npy", codes)
+    np.savez(
+        meta_path + ".tmp.npz",
+        build_id=np.array(build_id),
+        rows=np.array(matrix.shape[0]),
+        scales=scales if scales is not None else np.empty(0, dtype=np.float32),
+    )
+    os.replace(codes_path + ".tmp.npy", codes_path)
+    os.replace(meta_path + ".tmp.npz", meta_path)
+    return codes.nbytes + (scales.nbytes if scales is not None else 0)
+
+
+def load_quantized(db_path, dtype, matrix, build_id, candidates=QUANT_CANDIDATES):
+    """QuantizedRetriever over ``matrix``, or ``None`` if the files are missing or stale."""
+    codes_path, meta_path = quant_paths(db_path, dtype)
+    if not (os.path.exists(codes_path) and os.path.exists(meta_path)):
+        return None
+
+    with np.load(meta_path) as data:
+        if str(data["build_id"]) != str(build_id) or int(data["rows"]) != matrix.shape[0]:
+            return None
+        scales = data["scales"] if dtype == "int8" else None
+
+    codes = np.load(codes_path, mmap_mode="r")
+    if codes.shape != matrix.shape:
+        return None
+    return QuantizedRetriever(matrix, codes, scales, candidates=candidates)
+
+
+def assign_lists(matrix, centroids):
+    """Nearest centroid (max inner product) per row, tiled to bound memory."""
+    labels = np.empty(matrix.shape[0], dtype=np.int64)
+    for start in range(0, matrix.shape[0], ASSIGN_TILE):
+        block = np.asarray(matrix[start:start + ASSIGN_TILE])
+        labels[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+def train_kmeans(matrix, nlist, iters=KMEANS_ITERS, seed=0):
+    """Spherical k-means on a sample of the (already normalised) rows."""
+    rng = np.random.default_rng(seed)
+    n = matrix.shape[0]
+
+    sample_size = min(n, nlist * KMEANS_TRAIN_PER_LIST)
+    sample = np.asarray(matrix[np.sort(rng.choice(n, sample_size, replace=False))])
+    centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+    for _ in range(iters):
+        labels = assign_lists(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+
+        counts = np.bincount(labels, minlength=nlist)
+        empty = counts == 0
+        # Re-seed empty lists from random sample points
+        sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = (sums / np.maximum(norms, 1e-12)).astype(np.float32)
+
+    return centroids
+
+
+def build_ivf(matrix, nlist=None, seed=0):
+    """Train centroids and bucket every row; returns the arrays IVFRetriever needs."""
+    n = matrix.shape[0]
+    if nlist is None:
+        nlist = max(1, int(4 * np.sqrt(n)))
+    nlist = max(1, min(nlist, n))
+
+    centroids = train_kmeans(matrix, nlist, seed=seed) if n else np.empty((0, matrix.shape[1]), np.float32)
+    labels = assign_lists(matrix, centroids) if n else np.empty(0, dtype=np.int64)
+
+    list_rows = np.argsort(labels, kind="stable")
+    list_offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=len(centroids)))])
+    return centroids, list_offsets.astype(np.int64), list_rows.astype(np.int64)
+
+
+def ivf_path(db_path):
+    return f"{os.path.splitext(db_path)[0]}.ivf.npz"
+
+
+def save_ivf(path, build_id, rows, centroids, list_offsets, list_rows):
+    tmp = path + ".tmp.npz"
+    np.savez(
+        tmp,
+        build_id=np.array(build_id),
+        rows=np.array(rows),
+        centroids=centroids,
+        list_offsets=list_offsets,
+        list_rows=list_rows,
+    )
+    os.replace(tmp, path)
+
+
+def load_ivf(path, matrix, build_id, nprobe=IVF_NPROBE):
+    """IVFRetriever over ``matrix``, or ``None`` if the file is missing or stale."""
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path) as data:
+        if str(data["build_id"]) != str(build_id) or int(data["rows"]) != matrix.shape[0]:
+            return None
+        return IVFRetriever(
+            matrix,
+            data["centroids"],
+            data["list_offsets"],
+            data["list_rows"],
+            nprobe=nprobe,
+        )
+
+
+# -----------------------------
+# Recall Report
+# -----------------------------
+def recall_report(matrix, ivf=None, nprobes=(1, 2, 4, 8, 16, 32), k=10, n_queries=200, seed=0, quantized=()):
+    """recall@k, mean latency and vector memory of IVF / quantized vs the exact backend.
+
+    Queries are corpus rows with a little noise added, so no model is needed.
+    """
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(matrix.shape[0], min(n_queries, matrix.shape[0]), replace=False)
+    queries = np.asarray(matrix[picks]) + rng.normal(scale=0.05, size=(len(picks), matrix.shape[1]))
+    queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+    post_numbers = np.zeros(matrix.shape[0], dtype=np.int64)
+    exact = BruteForceRetriever(matrix)
+
+    def run(retriever):
+        results, start = [], time.perf_counter()
+        for q in queries:
+            rows, scores = retriever.candidate_scores(q)
+            results.append(set(select_top_k(rows, scores, post_numbers, k, -1.0)[0].tolist()))
+        return results, (time.perf_counter() - start) / len(queries) * 1000
+
+    def recall(got):
+        return float(np.mean([len(g & t) / max(len(t), 1) for g, t in zip(got, truth)]))
+
+    truth, exact_ms = run(exact)
+    report = [{"backend": "exact", "nprobe": None, "recall": 1.0, "ms_per_query": exact_ms, "mb": matrix.nbytes / 2**20}]
+
+    for nprobe in nprobes if ivf is not None else ():
+        ivf.nprobe = nprobe
+        got, ms = run(ivf)
+        report.append({"backend": "ivf", "nprobe": nprobe, "recall": recall(got), "ms_per_query": ms,
+                       "mb": matrix.nbytes / 2**20})
+
+    for retriever in quantized:
+        got, ms = run(retriever)
+        mb = (retriever.codes.nbytes + (retriever.scales.nbytes if retriever.scales is not None else 0)) / 2**20
+        report.append({"backend": retriever.name, "nprobe": None, "recall": recall(got), "ms_per_query": ms, "mb": mb})
+
+    return report
+
+
+def main(db_path="knowledge_base.db", k=10):
+    conn = sqlite3.connect(db_path)
+    loaded, reason = open_sidecar(conn, db_path, int(read_meta(conn).get("embedding_dim", 0)))
+    if loaded is None:
+        raise SystemExit(f"No usable vector sidecar ({reason}); rebuild the knowledge base first.")
+    matrix, _ = loaded
+
+    build_id = read_meta(conn).get("build_id")
+    ivf = load_ivf(ivf_path(db_path), matrix, build_id)
+    quantized = [q for q in (load_quantized(db_path, d, matrix, build_id) for d in QUANT_DTYPES) if q is not None]
+    if ivf is None and not quantized:
+        raise SystemExit("No usable IVF or quantized index; rebuild the knowledge base first.")
+
+    lists = f", {len(ivf.centroids)} lists" if ivf is not None else ""
+    print(f"recall@{k} over {matrix.shape[0]} rows{lists}")
+    for r in recall_report(matrix, ivf, k=k, quantized=quantized):
+        nprobe = "-" if r["nprobe"] is None else r["nprobe"]
+        print(
+            f"  {r['backend']:<7} nprobe={nprobe:<4} recall={r['recall']:.3f}  "
+            f"{r['ms_per_query']:.2f} ms/query  {r['mb']:.1f} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
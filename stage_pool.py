@@ -0,0 +1,76 @@
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+
+class StagePool:
+    """Bounded thread pool for one CPU-bound request stage (OCR, embedding, retrieval).
+
+    Tesseract runs as a subprocess and both PyTorch and NumPy release the
+    GIL, so threads keep the event loop free without duplicating the model
+    per process. At most ``workers`` calls run at once; once ``max_queue``
+    more are waiting, new calls are rejected with 503 instead of piling up.
+    """
+
+    def __init__(self, name, workers, max_queue):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-stage")
+        self._lock = threading.Lock()
+
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.peak_queued = 0
+
+    def _call(self, fn, args):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise HTTPException(status_code=503, detail=f"{self.name} stage is saturated, retry shortly")
+            self.queued += 1
+            self.peak_queued = max(self.peak_queued, self.queued)
+
+        # Run in a copy of the caller's context, so per-request state
+        # (e.g. metrics' stage timings) is visible inside the stage
+        future = self.executor.submit(contextvars.copy_context().run, self._call, fn, args)
+        future.add_done_callback(self._on_done)
+        return await asyncio.wrap_future(future)
+
+    def _on_done(self, future):
+        # A call cancelled before it started never reaches _call
+        if future.cancelled():
+            with self._lock:
+                self.queued -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "peak_queued": self.peak_queued,
+                "saturated": self.queued > 0 and self.running >= self.workers,
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
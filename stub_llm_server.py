@@ -0,0 +1,100 @@
+import json
+import time
+import random
+import asyncio
+import argparse
+
+from aiohttp import web
+
+# ------------------------------
+# CONFIG
+# ------------------------------
+HOST = "127.0.0.1"
+PORT = 8001
+
+STUB_ANSWER = (
+    "This is a stub answer generated from the provided context.\n\n"
+    "Sources:\n"
+    "URL: https://discourse.onlinedegree.iitm.ac.in/t/stub/1, Text: stub source"
+)
+
+
+def make_app(latency_ms=50.0, fail_rate=0.0, fail_status=503, retry_after=None, token_ms=10.0):
+    """An aiohttp app answering POST /v1/chat/completions like the real endpoint.
+
+    ``fail_rate`` of requests get ``fail_status`` (with ``Retry-After`` if
+    given) so retry behaviour can be exercised; ``GET /stats`` counts
+    requests and distinct client connections. With ``"stream": true`` the
+    answer is sent word by word as SSE chunks, ``token_ms`` apart.
+    """
+    counters = {"requests": 0, "failed": 0, "connections": set()}
+
+    async def chat_completions(request):
+        counters["requests"] += 1
+        counters["connections"].add(request.transport.get_extra_info("peername"))
+        payload = await request.json()
+        await asyncio.sleep(latency_ms / 1000)
+
+        if random.random() < fail_rate:
+            counters["failed"] += 1
+            headers = {"Retry-After": str(retry_after)} if retry_after is not None else {}
+            return web.json_response({"error": "stub failure"}, status=fail_status, headers=headers)
+
+        completion_id = f"chatcmpl-stub-{counters['requests']}"
+        if payload.get("stream"):
+            resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await resp.prepare(request)
+            for word in STUB_ANSWER.split(" "):
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "model": payload.get("model"),
+                    "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+                }
+                await resp.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                await asyncio.sleep(token_ms / 1000)
+            await resp.write(b"data: [DONE]\n\n")
+            await resp.write_eof()
+            return resp
+
+        return web.json_response({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": STUB_ANSWER},
+                "finish_reason": "stop",
+            }],
+        })
+
+    async def stats(request):
+        return web.json_response({
+            "requests": counters["requests"],
+            "failed": counters["failed"],
+            "connections": len(counters["connections"]),
+        })
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_get("/stats", stats)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the chat-completions endpoint.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--fail-status", type=int, default=503)
+    parser.add_argument("--retry-after", type=float, default=None, help="Retry-After seconds on failures")
+    parser.add_argument("--token-ms", type=float, default=10.0, help="delay between streamed tokens")
+    args = parser.parse_args()
+
+    print(f"🚀 Stub LLM on http://{args.host}:{args.port}/v1 (set OPENAI_BASE_URL to this)")
+    web.run_app(
+        make_app(args.latency_ms, args.fail_rate, args.fail_status, args.retry_after, args.token_ms),
+        host=args.host, port=args.port, print=None,
+    )
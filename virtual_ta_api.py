@@ -1,19 +1,34 @@
 import os
 import json
+import asyncio
 import sqlite3
 import logging
 import re
+import time
+from datetime import datetime, timezone
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi.exception_handlers import http_exception_handler
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
 from dotenv import load_dotenv
-import base64
-from io import BytesIO
-from PIL import Image
-import pytesseract
 import numpy as np
-import aiohttp
+from contextlib import asynccontextmanager
+
+from embedding_store import build_matrix, open_sidecar, read_meta
+from retrievers import BruteForceRetriever, ivf_path, load_ivf, load_quantized, rrf_fuse, select_top_k
+from query_cache import AnswerCache, EmbeddingCache, answer_cache_key
+from stage_pool import StagePool
+from embedding_batcher import EmbeddingBatcher
+from llm_client import LLMClient
+from context_builder import build_context, count_tokens
+from ocr import OCRService
+from lexical import LexicalIndex
+from metrics import (
+    CHUNKS, ERRORS, PROMPT_TOKENS, REGISTRY, REQUEST_SECONDS, RESPONSES,
+    server_timing, stage, start_request_timings,
+)
 
 # === NEW: Local Embedding Model ===
 from sentence_transformers import SentenceTransformer
@@ -35,10 +50,18 @@ logger.info(f"[Embedding] Using PyTorch device: {device}")
 embedder = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2", device=device)
 
 # === SQLite DB ===
-conn = sqlite3.connect("knowledge_base.db")
+DB_PATH = "knowledge_base.db"
+conn = sqlite3.connect(DB_PATH)
 
 # === FastAPI ===
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await llm_client.start()
+    yield
+    await llm_client.close()
+    ocr_service.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -50,9 +73,89 @@ app.add_middleware(
 SIMILARITY_THRESHOLD = 0.40
 MAX_RESULTS = 50
 
+# /query/batch limits: top_k is capped at MAX_RESULTS and a request holds at most
+# BATCH_MAX_QUESTIONS questions, so its score and result arrays stay bounded
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "1000"))
+
+# "exact" scans every row; "ivf" uses the builder's IVF index; "int8"/"float16" scan the
+# builder's quantized copy and re-score the best QUANT_CANDIDATES rows exactly
+# (all fall back to exact if their files are missing)
+RETRIEVER = os.getenv("RETRIEVER", "exact")
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+QUANT_CANDIDATES = int(os.getenv("QUANT_CANDIDATES", "200"))
+
+# Fuse BM25 hits from the builder's FTS5 table with vector results (reciprocal rank fusion)
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"
+LEXICAL_TOP_K = int(os.getenv("LEXICAL_TOP_K", "50"))
+
+# Query embedding cache; set EMBED_CACHE_PATH to persist/share it across workers
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "1024"))
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH")
+
+# LLM answer cache shared by all workers; set ANSWER_CACHE_PATH="" to disable
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "answer_cache.db")
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "86400"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "10000"))
+
+LLM_MODEL = "gpt-4o-mini"
+
+# Adds a Server-Timing header (per-stage ms) to every response
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+
+# Retrieved context is merged, deduplicated and packed into this many prompt tokens
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+
+# Pooled LLM connections; point OPENAI_BASE_URL at stub_llm_server.py for local runs
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://aipipe.org/openai/v1")
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "16"))
+LLM_KEEPALIVE = float(os.getenv("LLM_KEEPALIVE", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+
+llm_client = LLMClient(
+    OPENAI_BASE_URL,
+    API_KEY,
+    LLM_MODEL,
+    limit_per_host=LLM_MAX_CONNECTIONS,
+    keepalive_timeout=LLM_KEEPALIVE,
+    connect_timeout=LLM_CONNECT_TIMEOUT,
+    read_timeout=LLM_READ_TIMEOUT,
+    max_retries=LLM_MAX_RETRIES,
+)
+
+# CPU-bound stages run off the event loop, each with its own concurrency/queue limit
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "2"))
+OCR_QUEUE = int(os.getenv("OCR_QUEUE", "16"))
+OCR_CACHE_SIZE = int(os.getenv("OCR_CACHE_SIZE", "256"))
+OCR_MAX_IMAGE_MB = float(os.getenv("OCR_MAX_IMAGE_MB", "8"))
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "2000"))
+OCR_BINARIZE = os.getenv("OCR_BINARIZE", "1") == "1"
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "1"))
+EMBED_QUEUE = int(os.getenv("EMBED_QUEUE", "64"))
+RETRIEVE_WORKERS = int(os.getenv("RETRIEVE_WORKERS", "2"))
+RETRIEVE_QUEUE = int(os.getenv("RETRIEVE_QUEUE", "64"))
+
+# Query embeddings arriving within EMBED_MAX_WAIT_MS are encoded in one batch
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "32"))
+EMBED_MAX_WAIT_MS = float(os.getenv("EMBED_MAX_WAIT_MS", "5"))
+
+ocr_pool = StagePool("ocr", OCR_WORKERS, OCR_QUEUE)
+embed_pool = StagePool("embed", EMBED_WORKERS, EMBED_QUEUE)
+retrieve_pool = StagePool("retrieve", RETRIEVE_WORKERS, RETRIEVE_QUEUE)
+
+class SearchFilters(BaseModel):
+    source: Optional[Literal["forum", "course"]] = None
+    topic_ids: Optional[List[int]] = None
+    author: Optional[str] = None
+    since: Optional[datetime] = None        # forum posts only; naive times are UTC
+    until: Optional[datetime] = None
+
 class QueryRequest(BaseModel):
     question: str
     image: Optional[str] = None
+    filters: Optional[SearchFilters] = None
 
 class Link(BaseModel):
     url: str
@@ -62,88 +165,402 @@ class QueryResponse(BaseModel):
     answer: str
     links: List[Link]
 
+class BatchQueryRequest(BaseModel):
+    questions: List[str] = Field(max_length=BATCH_MAX_QUESTIONS)
+    top_k: int = Field(MAX_RESULTS, gt=0, le=MAX_RESULTS)
+    filters: Optional[SearchFilters] = None
+
+class RetrievedChunk(BaseModel):
+    chunk_id: str
+    source: str
+    url: str
+    text: str
+    similarity: float
+
+class BatchQueryResult(BaseModel):
+    question: str
+    chunks: List[RetrievedChunk]
+
+class BatchQueryResponse(BaseModel):
+    results: List[BatchQueryResult]
+
 
 # ------------------------------------------------
 # IMAGE → TEXT (OCR)
 # ------------------------------------------------
+# Tesseract runs in OCR_WORKERS processes; ocr_pool threads only wait on them
+ocr_service = OCRService(
+    workers=OCR_WORKERS,
+    cache_size=OCR_CACHE_SIZE,
+    max_bytes=int(OCR_MAX_IMAGE_MB * 1024 * 1024),
+    max_side=OCR_MAX_SIDE,
+    binarize=OCR_BINARIZE,
+)
+
+
 def extract_text_from_base64_image(image_base64: str) -> str:
-    try:
-        image_data = base64.b64decode(image_base64)
-        image = Image.open(BytesIO(image_data))
-        text = pytesseract.image_to_string(image).strip()
-        logger.info(f"OCR extracted text: '{text[:80]}...' ({len(text)} chars)")
-        return text
-    except Exception as e:
-        logger.warning(f"Failed to extract text from image: {e}")
-        return ""
+    return ocr_service.extract(image_base64)
 
 
 # ------------------------------------------------
 # LOCAL EMBEDDING
 # ------------------------------------------------
+embedding_cache = EmbeddingCache(
+    maxsize=EMBED_CACHE_SIZE,
+    path=EMBED_CACHE_PATH,
+    namespace="sentence-transformers/all-MiniLM-L6-v2",
+)
+
+
 def get_embedding(text: str):
-    """Compute local sentence-transformer embedding."""
-    return embedder.encode(text, convert_to_numpy=True).tolist()
+    """Compute local sentence-transformer embedding (cached on normalised text)."""
+    emb = embedding_cache.get_or_compute(
+        text, lambda t: embedder.encode(t, convert_to_numpy=True)
+    )
+    return emb.tolist()
+
+
+def encode_many(texts: List[str]):
+    """One model call for a whole micro-batch of questions."""
+    return embedder.encode(texts, convert_to_numpy=True, batch_size=min(len(texts), 64))
+
+
+embedding_batcher = EmbeddingBatcher(
+    encode_many, embed_pool, max_batch=EMBED_MAX_BATCH, max_wait_ms=EMBED_MAX_WAIT_MS
+)
+
+
+async def embed_question(text: str):
+    """Async, micro-batched counterpart of get_embedding used by the endpoints."""
+    emb = embedding_cache.peek(text)
+    if emb is None:
+        # In-memory miss: the SQLite layer (EMBED_CACHE_PATH) is read and written off the event loop
+        emb = await asyncio.to_thread(embedding_cache.get, text)
+        if emb is None:
+            emb = await asyncio.to_thread(embedding_cache.put, text, await embedding_batcher.embed(text))
+    return emb.tolist()
 
 
 # ------------------------------------------------
-# COSINE SIMILARITY
+# IN-MEMORY EMBEDDING INDEX
 # ------------------------------------------------
-def cosine_similarity(a, b):
-    a, b = np.array(a), np.array(b)
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+def post_number_from_url(url: str) -> int:
+    """Trailing numeric path segment of a forum URL (0 if absent)."""
+    last = (url or "").rstrip("/").split("/")[-1]
+    return int(last) if last.isdigit() else 0
+
+
+def parse_timestamp(value) -> float:
+    """Discourse ISO time → epoch seconds (NaN if missing or unparsable)."""
+    if not value:
+        return np.nan
+    try:
+        dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return np.nan
+    return (dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)).timestamp()
+
+
+class EmbeddingIndex:
+    """All chunk embeddings as one L2-normalised float32 matrix.
+
+    Row ``i`` of ``matrix`` belongs to ``sources[i]`` / ``urls[i]`` / ``texts[i]``,
+    so a query is scored with a single matrix-vector product. ``matrix`` may
+    be a read-only memmap shared by every worker on the box.
+
+    Filterable metadata is kept as columnar arrays (source and author
+    codes, topic ids, epoch ``created_at``) so a filter becomes a boolean
+    row mask before any scoring.
+    """
+
+    def __init__(self, matrix, chunk_ids, sources, urls, texts, post_numbers, retriever=None,
+                 topic_ids=None, authors=None, created_at=None):
+        n = matrix.shape[0]
+        self.matrix = matrix
+        self.chunk_ids = chunk_ids
+        self.sources = sources
+        self.urls = urls
+        self.texts = texts
+        self.post_numbers = post_numbers
+        self.retriever = retriever or BruteForceRetriever(matrix)
+
+        self.source_names, self.source_codes = np.unique(np.asarray(sources, dtype=str), return_inverse=True)
+        self.author_names, self.author_codes = np.unique(
+            np.asarray(authors if authors is not None else [""] * n, dtype=str), return_inverse=True
+        )
+        self.topic_ids = np.full(n, -1, dtype=np.int64) if topic_ids is None else np.asarray(topic_ids, dtype=np.int64)
+        self.created_at = np.full(n, np.nan) if created_at is None else np.asarray(created_at, dtype=np.float64)
+
+    def filter_mask(self, filters: Optional[SearchFilters]):
+        """Boolean row mask for ``filters`` (None when nothing is filtered)."""
+        if filters is None:
+            return None
+
+        mask = np.ones(len(self), dtype=bool)
+        applied = False
+
+        def code_mask(names, codes, value):
+            i = np.searchsorted(names, value)
+            return codes == i if i < len(names) and names[i] == value else np.zeros(len(codes), dtype=bool)
+
+        if filters.source:
+            mask &= code_mask(self.source_names, self.source_codes, filters.source)
+            applied = True
+        if filters.topic_ids:
+            mask &= np.isin(self.topic_ids, filters.topic_ids)
+            applied = True
+        if filters.author:
+            mask &= code_mask(self.author_names, self.author_codes, filters.author)
+            applied = True
+        # NaN (no date, e.g. course chunks) fails both comparisons
+        if filters.since:
+            mask &= self.created_at >= parse_timestamp(filters.since.isoformat())
+            applied = True
+        if filters.until:
+            mask &= self.created_at <= parse_timestamp(filters.until.isoformat())
+            applied = True
+
+        return mask if applied else None
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @classmethod
+    def from_rows(cls, conn, matrix, row_keys) -> "EmbeddingIndex":
+        """Attach url/text and filter metadata to ``matrix`` via its (table, chunk_id) row keys."""
+        forum_columns = {row[1] for row in conn.execute("PRAGMA table_info(forum_chunks)")}
+        created_at = "created_at" if "created_at" in forum_columns else "NULL"
+
+        lookup = {}
+        for chunk_id, url, text, topic_id, author, created in conn.execute(
+            f"SELECT chunk_id, url, text, topic_id, author, {created_at} FROM forum_chunks"
+        ):
+            lookup[("forum_chunks", chunk_id)] = (url, text, topic_id, author, created)
+        for chunk_id, url, text in conn.execute("SELECT chunk_id, url, text FROM course_chunks"):
+            lookup[("course_chunks", chunk_id)] = (url, text, None, None, None)
+
+        chunk_ids, sources, urls, texts, topic_ids, authors, created = [], [], [], [], [], [], []
+        for table, chunk_id in row_keys:
+            url, text, topic_id, author, created_ts = lookup[(table, chunk_id)]
+            chunk_ids.append(chunk_id)
+            sources.append(table.replace("_chunks", ""))
+            urls.append(url)
+            texts.append(text)
+            topic_ids.append(topic_id if topic_id is not None else -1)
+            authors.append(author or "")
+            created.append(parse_timestamp(created_ts))
+
+        return cls(
+            matrix=matrix,
+            chunk_ids=chunk_ids,
+            sources=sources,
+            urls=urls,
+            texts=texts,
+            post_numbers=np.array([post_number_from_url(u) for u in urls], dtype=np.int64),
+            topic_ids=topic_ids,
+            authors=authors,
+            created_at=created,
+        )
+
+    @classmethod
+    def from_db(cls, conn, dim: int) -> "EmbeddingIndex":
+        """Decode every embedding row (blob or legacy JSON) into a private matrix."""
+        matrix, row_keys = build_matrix(conn, dim)
+        return cls.from_rows(conn, matrix, row_keys)
+
+    @classmethod
+    def load(cls, conn, db_path: str, dim: int) -> "EmbeddingIndex":
+        """Prefer the shared memory-mapped sidecar; fall back to the DB if it is stale."""
+        loaded, reason = open_sidecar(conn, db_path, dim)
+        if loaded is not None:
+            matrix, row_keys = loaded
+            index = cls.from_rows(conn, matrix, row_keys)
+            logger.info(f"[Index] Mapped {len(index)} chunk embeddings from sidecar (dim={dim})")
+        else:
+            logger.warning(f"[Index] Sidecar not used ({reason}); loading embeddings from DB")
+            index = cls.from_db(conn, dim)
+            logger.info(f"[Index] Loaded {len(index)} chunk embeddings (dim={dim})")
+        return index
+
+    def search(self, query_embedding, top_k=MAX_RESULTS, threshold=SIMILARITY_THRESHOLD, mask=None):
+        """Top-k rows with cosine similarity >= threshold, among ``mask`` rows if given.
+
+        Ordering matches the old per-row scan: similarity desc, then
+        post_number desc, then table/row order.
+        """
+        q = np.asarray(query_embedding, dtype=np.float32)
+        q_norm = np.linalg.norm(q)
+        if len(self) == 0 or q.shape != (self.matrix.shape[1],) or q_norm == 0:
+            return []
+
+        rows, scores = self.retriever.candidate_scores(q / q_norm, mask)
+        rows, scores = select_top_k(rows, scores, self.post_numbers, top_k, threshold)
+        return [self._result(i, score) for i, score in zip(rows, scores)]
+
+    def search_hybrid(self, query_embedding, lexical_rows, top_k=MAX_RESULTS, threshold=SIMILARITY_THRESHOLD, mask=None):
+        """Vector top-k fused with BM25-ranked ``lexical_rows`` by reciprocal rank.
+
+        Lexical hits below the cosine threshold still get in, which is the
+        point: exact tokens like "GA4" or an error name. ``similarity`` stays
+        the cosine score; ``relevance`` is the fused score scaled to [0, 1]
+        and gives the result order.
+        """
+        q = np.asarray(query_embedding, dtype=np.float32)
+        q_norm = np.linalg.norm(q)
+        if len(self) == 0 or q.shape != (self.matrix.shape[1],) or q_norm == 0:
+            return []
+        q = q / q_norm
+
+        rows, scores = self.retriever.candidate_scores(q, mask)
+        dense_rows, _ = select_top_k(rows, scores, self.post_numbers, top_k, threshold)
+        if mask is not None:
+            lexical_rows = [row for row in lexical_rows if mask[row]]
+        rows, fused = rrf_fuse([dense_rows, lexical_rows], top_k)
+        if not len(rows):
+            return []
+
+        similarities = self.matrix[rows] @ q
+        return [
+            dict(self._result(i, sim), relevance=float(score / fused[0]))
+            for i, sim, score in zip(rows, similarities, fused)
+        ]
+
+    def _result(self, i, similarity):
+        return {
+            "chunk_id": self.chunk_ids[i],
+            "source": self.sources[i],
+            "text": self.texts[i],
+            "url": self.urls[i],
+            "similarity": float(similarity),
+            "post_number": int(self.post_numbers[i]),
+            "row": int(i),
+        }
+
+    def search_batch(self, query_embeddings, top_k=MAX_RESULTS, threshold=SIMILARITY_THRESHOLD, mask=None):
+        """``search`` for many queries at once; one result list per query."""
+        q = np.asarray(query_embeddings, dtype=np.float32).reshape(-1, self.matrix.shape[1])
+        norms = np.linalg.norm(q, axis=1, keepdims=True)
+        q = np.divide(q, norms, out=np.zeros_like(q), where=norms > 0)
+
+        if len(self) == 0:
+            return [[] for _ in q]
+
+        rows, scores = self.retriever.search_batch(q, self.post_numbers, top_k, threshold, mask)
+        return [
+            [self._result(i, score) for i, score in zip(row_ids, row_scores) if i >= 0]
+            for row_ids, row_scores in zip(rows, scores)
+        ]
+
+
+kb_meta = read_meta(conn)
+if kb_meta.get("embedding_dim") and int(kb_meta["embedding_dim"]) != embedder.get_sentence_embedding_dimension():
+    logger.warning(f"[Index] knowledge_base.db embedding_dim={kb_meta['embedding_dim']} does not match the model")
+
+embedding_index = EmbeddingIndex.load(conn, DB_PATH, embedder.get_sentence_embedding_dimension())
+
+if RETRIEVER == "ivf":
+    ivf = load_ivf(ivf_path(DB_PATH), embedding_index.matrix, kb_meta.get("build_id"), nprobe=IVF_NPROBE)
+    if ivf is not None:
+        embedding_index.retriever = ivf
+        logger.info(f"[Index] Using IVF retriever ({len(ivf.centroids)} lists, nprobe={IVF_NPROBE})")
+    else:
+        logger.warning("[Index] IVF index missing or stale; using exact retriever")
+elif RETRIEVER in ("int8", "float16"):
+    quantized = load_quantized(
+        DB_PATH, RETRIEVER, embedding_index.matrix, kb_meta.get("build_id"), candidates=QUANT_CANDIDATES
+    )
+    if quantized is not None:
+        embedding_index.retriever = quantized
+        logger.info(f"[Index] Using {RETRIEVER} first pass, {QUANT_CANDIDATES} candidates re-scored exactly")
+    else:
+        logger.warning(f"[Index] {RETRIEVER} vectors missing or stale (build with --quantize {RETRIEVER}); using exact retriever")
+
+lexical_index = None
+if HYBRID_SEARCH:
+    if LexicalIndex.available(conn):
+        lexical_index = LexicalIndex(DB_PATH, {chunk_id: i for i, chunk_id in enumerate(embedding_index.chunk_ids)})
+        logger.info("[Index] Hybrid search: BM25 (FTS5) fused with vector results")
+    else:
+        logger.warning("[Index] No FTS index in knowledge_base.db (rebuild the KB); using vector search only")
+
+# Keyed on the KB build id, so a rebuilt knowledge base never serves old answers
+answer_cache = (
+    AnswerCache(ANSWER_CACHE_PATH, kb_meta.get("build_id"), ttl=ANSWER_CACHE_TTL, maxsize=ANSWER_CACHE_SIZE)
+    if ANSWER_CACHE_PATH
+    else None
+)
 
 
 # ------------------------------------------------
 # EMBEDDING SEARCH
 # ------------------------------------------------
-def retrieve_similar_chunks(question: str, top_k=MAX_RESULTS):
-    logger.info(f"Embedding query text locally...")
-    question_embedding = get_embedding(question)
+def search_chunks(question_embedding, top_k=MAX_RESULTS, query_text: Optional[str] = None,
+                  filters: Optional[SearchFilters] = None):
+    """Vector search, fused with BM25 over ``query_text`` when the FTS index is available.
 
-    all_chunks = []
+    ``filters`` restrict both to the matching rows before anything is scored.
+    """
+    mask = embedding_index.filter_mask(filters)
+    if mask is not None:
+        logger.info(f"Filters match {int(mask.sum())} of {len(embedding_index)} chunks")
 
-    for table in ["forum_chunks", "course_chunks"]:
-        logger.info(f"Checking {table} for similar chunks...")
-        cursor = conn.execute(f"SELECT url, text, embedding FROM {table}")
+    if lexical_index is None or not query_text:
+        chunks = embedding_index.search(question_embedding, top_k=top_k, mask=mask)
+        logger.info(f"✅ Retrieved {len(chunks)} relevant chunks")
+        return chunks
 
-        for url, text, emb_json in cursor.fetchall():
-            try:
-                emb = json.loads(emb_json)
+    start = time.perf_counter()
+    lexical_rows = lexical_index.search(query_text, limit=LEXICAL_TOP_K, mask=mask)
+    lexical_ms = (time.perf_counter() - start) * 1000
 
-                if len(emb) != len(question_embedding):
-                    continue
+    chunks = embedding_index.search_hybrid(question_embedding, lexical_rows, top_k=top_k, mask=mask)
+    logger.info(f"✅ Retrieved {len(chunks)} relevant chunks ({len(lexical_rows)} lexical hits in {lexical_ms:.1f} ms)")
+    return chunks
 
-                similarity = cosine_similarity(question_embedding, emb)
 
-                if similarity >= SIMILARITY_THRESHOLD:
-                    all_chunks.append({
-                        "source": table.replace("_chunks", ""),
-                        "text": text,
-                        "url": url,
-                        "similarity": similarity,
-                        "post_number": (
-                            int(url.rstrip("/").split("/")[-1])
-                            if url.rstrip("/").split("/")[-1].isdigit()
-                            else 0
-                        )
-                    })
-            except Exception as e:
-                logger.warning(f"Skipping row → {e}")
+def retrieve_similar_chunks(question: str, top_k=MAX_RESULTS, filters: Optional[SearchFilters] = None):
+    logger.info(f"Embedding query text locally...")
+    question_embedding = get_embedding(question)
+    return search_chunks(question_embedding, top_k=top_k, query_text=question, filters=filters)
+
 
-    logger.info(f"✅ Retrieved {len(all_chunks)} relevant chunks")
+def embed_questions(questions: List[str]):
+    """Embeddings for many questions: cache hits reused, misses encoded together."""
+    embeddings = [embedding_cache.get(q) for q in questions]
+    missing = list(dict.fromkeys(q for q, e in zip(questions, embeddings) if e is None))
 
-    return sorted(all_chunks, key=lambda x: (-x["similarity"], -x["post_number"]))[:top_k]
+    if missing:
+        encoded = dict(zip(missing, encode_many(missing)))
+        embeddings = [
+            e if e is not None else embedding_cache.put(q, encoded[q])
+            for q, e in zip(questions, embeddings)
+        ]
+    return np.vstack(embeddings) if embeddings else np.empty((0, embedder.get_sentence_embedding_dimension()))
+
+
+def retrieve_similar_chunks_batch(questions: List[str], top_k=MAX_RESULTS, filters: Optional[SearchFilters] = None):
+    """Batch counterpart of retrieve_similar_chunks for evaluation runs and log replays."""
+    mask = embedding_index.filter_mask(filters)
+    results = embedding_index.search_batch(embed_questions(questions), top_k=top_k, mask=mask)
+    logger.info(f"✅ Retrieved chunks for {len(questions)} questions")
+    return results
 
 
 # ------------------------------------------------
 # USE LLM FOR FINAL ANSWER (AIPipe)
 # ------------------------------------------------
-async def generate_llm_answer(question: str, chunks: List[dict], extracted_text: Optional[str] = None) -> str:
-
+def build_llm_messages(question: str, chunks: List[dict], extracted_text: Optional[str] = None) -> List[dict]:
+
+    with stage("prompt"):
+        blocks, stats = build_context(
+            chunks,
+            embedding_index.matrix[[c["row"] for c in chunks]],
+            token_budget=CONTEXT_TOKEN_BUDGET,
+            mmr_lambda=CONTEXT_MMR_LAMBDA,
+        )
     context = "\n\n".join([
-        f"{c['source'].capitalize()} (URL: {c['url']}): {c['text'][:1500]}"
-        for c in chunks
+        f"{b['source'].capitalize()} (URL: {b['url']}): {b['text']}"
+        for b in blocks
     ])
 
     extracted_section = f"OCR-extracted Text:\n{extracted_text}\n\n" if extracted_text else ""
@@ -166,33 +583,152 @@ User Question:
 Provide final answer + list of sources used.
 """
 
-    headers = {"Authorization": API_KEY, "Content-Type": "application/json"}
-    payload = {
-        "model": "gpt-4o-mini",
-        "messages": [
-            {"role": "system",
-             "content": "Answer ONLY from provided context. Always cite URLs used."},
-            {"role": "user", "content": prompt},
-        ],
-        "temperature": 0.1
-    }
+    messages = [
+        {"role": "system",
+         "content": "Answer ONLY from provided context. Always cite URLs used."},
+        {"role": "user", "content": prompt},
+    ]
 
+    prompt_tokens = sum(count_tokens(m["content"]) for m in messages)
+    CHUNKS.inc(stats["kept"], kind="prompt")
+    PROMPT_TOKENS.inc(prompt_tokens)
+    logger.info(
+        f"Prompt tokens: {prompt_tokens} (context {stats['context_tokens']}/{CONTEXT_TOKEN_BUDGET}; "
+        f"{stats['chunks']} chunks → {stats['merged']} merged → {stats['kept']} kept, "
+        f"{stats['duplicates']} near-duplicates dropped)"
+    )
+    return messages
+
+
+async def generate_llm_answer(question: str, chunks: List[dict], extracted_text: Optional[str] = None) -> str:
     logger.info("Sending LLM request to AIPipe...")
+    return await llm_client.chat(build_llm_messages(question, chunks, extracted_text), temperature=0.1)
+
+
+def parse_llm_output(llm_output: str):
+    """Split the LLM answer from its "Sources:" list."""
+    if "Sources:" in llm_output:
+        answer_part, sources_part = llm_output.split("Sources:", 1)
+    else:
+        answer_part, sources_part = llm_output, ""
+
+    links = []
+    for match in re.finditer(r"URL:\s*(\S+),\s*Text:\s*(.*)", sources_part):
+        url, text = match.groups()
+        links.append(Link(url=url.strip(), text=text.strip()))
+
+    return answer_part.strip(), links
+
+
+async def timed_embed_question(text: str):
+    with stage("embed"):
+        return await embed_question(text)
+
+
+async def retrieve_for_request(req: QueryRequest):
+    """OCR + query embedding (concurrently, in their own pools), then retrieval."""
+    embedding_task = asyncio.ensure_future(timed_embed_question(req.question))
+
+    extracted_text = None
+    if req.image:
+        try:
+            # "image" is the whole wait; decode/preprocess/ocr are recorded by the OCR service
+            with stage("image"):
+                extracted_text = await ocr_pool.run(extract_text_from_base64_image, req.image)
+        except BaseException:
+            embedding_task.cancel()
+            raise
+
+    question_embedding = await embedding_task
+    # OCR'd error messages are exactly the kind of tokens BM25 is good at
+    query_text = f"{req.question} {extracted_text}" if extracted_text else req.question
+    with stage("retrieve"):
+        chunks = await retrieve_pool.run(search_chunks, question_embedding, MAX_RESULTS, query_text, req.filters)
+    CHUNKS.inc(len(chunks), kind="retrieved")
+    return extracted_text, chunks
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            "https://aipipe.org/openai/v1/chat/completions",
-            headers=headers,
-            json=payload
-        ) as resp:
 
-            if resp.status != 200:
-                error = await resp.text()
-                logger.error(error)
-                raise HTTPException(status_code=resp.status, detail=error)
+# ------------------------------------------------
+# METRICS
+# ------------------------------------------------
+def route_path(request: Request) -> str:
+    """Route template (not the raw URL), so metric labels stay bounded."""
+    route = request.scope.get("route")
+    return route.path if route is not None else "unmatched"
+
 
-            result = await resp.json()
-            return result["choices"][0]["message"]["content"]
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    timings = start_request_timings()
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    except Exception as e:
+        ERRORS.inc(path=route_path(request), error=type(e).__name__)
+        RESPONSES.inc(path=route_path(request), status="500")
+        raise
+
+    path = route_path(request)
+    REQUEST_SECONDS.observe(time.perf_counter() - start, path=path)
+    RESPONSES.inc(path=path, status=str(response.status_code))
+    if SERVER_TIMING:
+        # Streamed responses only include the stages finished before the first byte
+        timings["total"] = time.perf_counter() - start
+        response.headers["Server-Timing"] = server_timing(timings)
+    return response
+
+
+@app.exception_handler(HTTPException)
+async def count_http_errors(request: Request, exc: HTTPException):
+    ERRORS.inc(path=route_path(request), error=f"HTTP {exc.status_code}")
+    return await http_exception_handler(request, exc)
+
+
+def collect_component_stats():
+    """Cache, OCR, LLM and pool counters already kept by each component."""
+    embedding = embedding_cache.stats()
+    families = [
+        ("embedding_cache_events_total", "counter", "Query embedding cache lookups.",
+         [({"result": k}, embedding[k]) for k in ("hits", "disk_hits", "misses", "evictions")]),
+        ("embedding_cache_size", "gauge", "Query embeddings held in memory.", [({}, embedding["size"])]),
+    ]
+    if answer_cache:
+        answer = answer_cache.stats()
+        families += [
+            ("answer_cache_events_total", "counter", "LLM answer cache lookups.",
+             [({"result": k}, answer[k]) for k in ("hits", "misses", "expired")]),
+            ("answer_cache_size", "gauge", "Cached LLM answers.", [({}, answer["size"])]),
+        ]
+
+    ocr = ocr_service.stats()
+    llm = llm_client.stats()
+    pools = [pool.stats() | {"name": pool.name} for pool in (ocr_pool, embed_pool, retrieve_pool)]
+    families += [
+        ("ocr_cache_events_total", "counter", "OCR results by cache outcome.",
+         [({"result": k}, ocr[k]) for k in ("hits", "misses", "failures")]),
+        ("llm_requests_total", "counter", "LLM calls by outcome.",
+         [({"result": k}, llm[k]) for k in ("succeeded", "failed")]),
+        ("llm_retries_total", "counter", "LLM retries by reason.",
+         [({"reason": r}, n) for r, n in llm["retry_reasons"].items()]),
+        ("llm_connections_total", "counter", "LLM connections opened vs reused.",
+         [({"kind": "created"}, llm["connections_created"]), ({"kind": "reused"}, llm["connections_reused"])]),
+        ("pool_queued", "gauge", "Calls waiting per stage pool.", [({"pool": p["name"]}, p["queued"]) for p in pools]),
+        ("pool_running", "gauge", "Calls running per stage pool.", [({"pool": p["name"]}, p["running"]) for p in pools]),
+        ("pool_rejected_total", "counter", "Calls rejected with 503 per stage pool.",
+         [({"pool": p["name"]}, p["rejected"]) for p in pools]),
+    ]
+    return families
+
+
+REGISTRY.register_collector(collect_component_stats)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus text format; counters are per worker process."""
+    # Collectors read SQLite (answer cache size), so render off the event loop
+    text = await asyncio.to_thread(REGISTRY.render)
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
 
 
 # ------------------------------------------------
@@ -202,27 +738,140 @@ Provide final answer + list of sources used.
 async def query_virtual_ta(req: QueryRequest, request: Request):
     logger.info(f"Incoming request from IP: {request.client.host}")
 
-    extracted_text = None
-    if req.image:
-        extracted_text = extract_text_from_base64_image(req.image)
-
-    chunks = retrieve_similar_chunks(req.question)
+    extracted_text, chunks = await retrieve_for_request(req)
 
     if not chunks:
         return QueryResponse(answer="I couldn't find relevant content.", links=[])
 
-    llm_output = await generate_llm_answer(req.question, chunks, extracted_text)
+    cache_key = answer_cache_key(
+        req.question, extracted_text, [c["chunk_id"] for c in chunks], LLM_MODEL
+    )
+    # SQLite reads/writes (and their commits) run off the event loop
+    llm_output = await asyncio.to_thread(answer_cache.get, cache_key) if answer_cache else None
 
-    # Parse sources
-    if "Sources:" in llm_output:
-        answer_part, sources_part = llm_output.split("Sources:", 1)
+    if llm_output is None:
+        llm_output = await generate_llm_answer(req.question, chunks, extracted_text)
+        if answer_cache:
+            await asyncio.to_thread(answer_cache.put, cache_key, llm_output)
     else:
-        answer_part, sources_part = llm_output, ""
+        logger.info("Answer served from cache")
+
+    answer, links = parse_llm_output(llm_output)
+    return QueryResponse(answer=answer, links=links)
+
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/query/stream")
+async def query_virtual_ta_stream(req: QueryRequest, request: Request):
+    """Same answer as /query, sent as Server-Sent Events while it is generated.
+
+    Events: ``links`` (retrieved sources, sent before the LLM call),
+    ``token`` (answer text deltas), ``done`` (full answer and the sources
+    the LLM cited) or ``error``.
+    """
+    logger.info(f"Incoming stream request from IP: {request.client.host}")
+    start = time.perf_counter()
+
+    # Retrieval errors (e.g. 503 from a saturated pool) still surface as HTTP errors
+    extracted_text, chunks = await retrieve_for_request(req)
+
+    async def events():
+        first_token_ms = None
+
+        retrieved = list({c["url"]: {"url": c["url"], "text": c["text"][:100]} for c in chunks}.values())
+        yield sse_event("links", retrieved)
+        links_ms = (time.perf_counter() - start) * 1000
+
+        if not chunks:
+            yield sse_event("done", {"answer": "I couldn't find relevant content.", "links": []})
+            return
+
+        cache_key = answer_cache_key(
+            req.question, extracted_text, [c["chunk_id"] for c in chunks], LLM_MODEL
+        )
+        llm_output = await asyncio.to_thread(answer_cache.get, cache_key) if answer_cache else None
+
+        try:
+            if llm_output is not None:
+                logger.info("Answer served from cache")
+                first_token_ms = (time.perf_counter() - start) * 1000
+                yield sse_event("token", {"text": llm_output})
+            else:
+                parts = []
+                messages = build_llm_messages(req.question, chunks, extracted_text)
+                async for delta in llm_client.chat_stream(messages, temperature=0.1):
+                    if first_token_ms is None:
+                        first_token_ms = (time.perf_counter() - start) * 1000
+                    parts.append(delta)
+                    yield sse_event("token", {"text": delta})
+
+                llm_output = "".join(parts)
+                if answer_cache:
+                    await asyncio.to_thread(answer_cache.put, cache_key, llm_output)
+        except HTTPException as e:
+            ERRORS.inc(path=route_path(request), error=f"HTTP {e.status_code}")
+            yield sse_event("error", {"status": e.status_code, "detail": e.detail})
+            return
+        except Exception as e:
+            logger.error(f"Stream failed: {e}")
+            ERRORS.inc(path=route_path(request), error=type(e).__name__)
+            yield sse_event("error", {"status": 502, "detail": "Answer stream was interrupted"})
+            return
+
+        answer, links = parse_llm_output(llm_output)
+        yield sse_event("done", {"answer": answer, "links": [{"url": l.url, "text": l.text} for l in links]})
+
+        total_ms = (time.perf_counter() - start) * 1000
+        if first_token_ms is None:
+            first_token_ms = total_ms
+        logger.info(
+            f"Stream timings: links {links_ms:.0f} ms, first token {first_token_ms:.0f} ms, total {total_ms:.0f} ms"
+        )
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/query/batch", response_model=BatchQueryResponse)
+async def query_batch(req: BatchQueryRequest, request: Request):
+    """Retrieval only (no LLM call) for many questions in one request."""
+    logger.info(f"Incoming batch of {len(req.questions)} questions from IP: {request.client.host}")
+
+    # Runs in the embed pool: encoding the questions is the model-bound part
+    results = await embed_pool.run(retrieve_similar_chunks_batch, req.questions, req.top_k, req.filters)
+
+    return BatchQueryResponse(results=[
+        BatchQueryResult(question=q, chunks=[RetrievedChunk(**c) for c in chunks])
+        for q, chunks in zip(req.questions, results)
+    ])
 
-    links = []
-    for match in re.finditer(r"URL:\s*(\S+),\s*Text:\s*(.*)", sources_part):
-        url, text = match.groups()
-        links.append(Link(url=url.strip(), text=text.strip()))
 
-    return QueryResponse(answer=answer_part.strip(), links=links)
+@app.get("/pools/stats")
+async def pool_stats():
+    stats = {pool.name: pool.stats() for pool in (ocr_pool, embed_pool, retrieve_pool)}
+    stats["embed_batching"] = embedding_batcher.stats()
+    return stats
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {
+        "embedding": embedding_cache.stats(),
+        "answer": await asyncio.to_thread(answer_cache.stats) if answer_cache else None,
+    }
+
+
+@app.get("/ocr/stats")
+async def ocr_stats():
+    return ocr_service.stats()
+
 
+@app.get("/llm/stats")
+async def llm_stats():
+    return llm_client.stats()
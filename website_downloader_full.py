@@ -1,52 +1,87 @@
 import os
 import json
 import re
+import time
+import asyncio
+import hashlib
+import argparse
+import posixpath
+from collections import Counter
 from datetime import datetime
-from urllib.parse import urljoin
+from urllib.parse import urlsplit
 from markdownify import markdownify as md
-from playwright.sync_api import sync_playwright
+from playwright.async_api import async_playwright
 
+# ------------------------------
+# CONFIG
+# ------------------------------
 BASE_URL = "https://tds.s-anand.net/#/2025-01/"
 BASE_ORIGIN = "https://tds.s-anand.net"
 OUTPUT_DIR = "tds_pages_md"
 METADATA_FILE = "metadata.json"
 
-visited = set()
-metadata = []
+PAGES = 4                 # browser pages crawling in parallel
+ARTICLE_SELECTOR = "article.markdown-section#main"
+READY_TIMEOUT = 10000     # ms for docsify to render a route's article
+
+# docsify re-renders the article in place on a hash change, so the pool
+# empties it before navigating and waits for it to fill again.
+CLEAR_ARTICLE_JS = "sel => { const el = document.querySelector(sel); if (el) el.replaceChildren(); }"
+ARTICLE_READY_JS = "sel => { const el = document.querySelector(sel); return !!el && el.children.length > 0; }"
+
 
 def sanitize_filename(title):
     return re.sub(r'[\\/*?:"<>|]', "_", title).strip().replace(" ", "_")
 
-def extract_all_internal_links(page):
-    links = page.eval_on_selector_all("a[href]", "els => els.map(el => el.href)")
-    return list(set(
-        link for link in links
+
+def canonical_url(url):
+    """One URL per docsify route: ``#/2025-01/../marimo`` → ``#/marimo``.
+
+    ``?id=`` section anchors point into the same page and are dropped;
+    a trailing slash (a folder's README) is kept.
+    """
+    route = urlsplit(url).fragment.partition("?")[0] or "/"
+    path = posixpath.normpath("/" + route.lstrip("/"))
+    if route.endswith("/") and path != "/":
+        path += "/"
+    return f"{BASE_ORIGIN}/#{path}"
+
+
+def content_hash(html):
+    return hashlib.sha256(html.encode("utf-8")).hexdigest()
+
+
+def load_metadata(path=METADATA_FILE):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_metadata(entries, path=METADATA_FILE):
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(entries, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+async def extract_all_internal_links(page):
+    links = await page.eval_on_selector_all("a[href]", "els => els.map(el => el.href)")
+    # dict keeps page order, so the crawl (and filename claims) stay deterministic
+    return list(dict.fromkeys(
+        canonical_url(link) for link in links
         if BASE_ORIGIN in link and '/#/' in link
     ))
 
-def wait_for_article_and_get_html(page):
-    page.wait_for_selector("article.markdown-section#main", timeout=10000)
-    return page.inner_html("article.markdown-section#main")
-
-def crawl_page(page, url):
-    if url in visited:
-        return
-    visited.add(url)
-
-    print(f"📄 Visiting: {url}")
-    try:
-        page.goto(url, wait_until="domcontentloaded")
-        page.wait_for_timeout(1000)
-        html = wait_for_article_and_get_html(page)
-    except Exception as e:
-        print(f"❌ Error loading page: {url}\n{e}")
-        return
-
-    # Extract title and save markdown
-    title = page.title().split(" - ")[0].strip() or f"page_{len(visited)}"
-    filename = sanitize_filename(title)
-    filepath = os.path.join(OUTPUT_DIR, f"{filename}.md")
 
+async def render_article(page, url):
+    """Navigate and wait until this route's article has rendered (no fixed sleep)."""
+    await page.evaluate(CLEAR_ARTICLE_JS, ARTICLE_SELECTOR)
+    await page.goto(url, wait_until="domcontentloaded")
+    await page.wait_for_function(ARTICLE_READY_JS, arg=ARTICLE_SELECTOR, timeout=READY_TIMEOUT)
+    return await page.inner_html(ARTICLE_SELECTOR)
+
+
+def write_markdown(filepath, title, url, html):
     markdown = md(html)
     with open(filepath, "w", encoding="utf-8") as f:
         f.write(f"---\n")
@@ -56,34 +91,144 @@ def crawl_page(page, url):
         f.write(f"---\n\n")
         f.write(markdown)
 
-    metadata.append({
-        "title": title,
-        "filename": f"{filename}.md",
-        "original_url": url,
-        "downloaded_at": datetime.now().isoformat()
-    })
-
-    # Recursively crawl all links found on the page (not just main content)
-    links = extract_all_internal_links(page)
-    for link in links:
-        if link not in visited:
-            crawl_page(page, link)
-
-def main():
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    global visited, metadata
-
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        context = browser.new_context()
-        page = context.new_page()
-        crawl_page(page, BASE_URL)
 
-        with open(METADATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(metadata, f, indent=2)
+# ------------------------------
+# CRAWLER
+# ------------------------------
+class Crawler:
+    """Breadth-first crawl of the course site over a pool of browser pages.
+
+    URLs are deduplicated after canonicalization and pages by a hash of
+    their rendered article, so aliases are recorded instead of saved
+    twice. A page whose hash matches the previous ``metadata.json`` entry
+    is left on disk untouched unless ``force`` is set.
+    """
+
+    def __init__(self, output_dir=OUTPUT_DIR, previous=(), force=False):
+        self.output_dir = output_dir
+        self.force = force
+        self.previous = {m["original_url"]: m for m in previous}
+        # Filenames from the last run stay with their URL, so reruns don't shuffle them
+        self.claimed = {m["filename"]: m["original_url"] for m in previous}
+        self.seen = set()
+        self.queue = asyncio.Queue()
+        self.pages = {}          # content hash → metadata entry
+        self.counts = Counter()
+
+    def enqueue(self, url):
+        url = canonical_url(url)
+        if url not in self.seen:
+            self.seen.add(url)
+            self.queue.put_nowait(url)
+
+    def claim_filename(self, title, url):
+        previous = self.previous.get(url)
+        if previous and self.claimed.get(previous["filename"]) == url:
+            return previous["filename"]
+        filename = f"{sanitize_filename(title)}.md"
+        if self.claimed.get(filename, url) != url:
+            route = urlsplit(url).fragment.strip("/").replace("/", "_")
+            filename = f"{sanitize_filename(title)}__{sanitize_filename(route)}.md"
+        self.claimed[filename] = url
+        return filename
+
+    async def visit(self, page, url):
+        print(f"📄 Visiting: {url}")
+        try:
+            html = await render_article(page, url)
+            links = await extract_all_internal_links(page)
+            title = (await page.title()).split(" - ")[0].strip() or f"page_{len(self.seen)}"
+        except Exception as e:
+            print(f"❌ Error loading page: {url}\n{e}")
+            self.counts["failed"] += 1
+            return
+
+        # Crawl all links found on the page (not just main content)
+        for link in links:
+            self.enqueue(link)
+
+        digest = content_hash(html)
+        if digest in self.pages:
+            self.pages[digest]["aliases"].append(url)
+            self.counts["duplicate"] += 1
+            return
+
+        previous = self.previous.get(url)
+        filename = self.claim_filename(title, url)
+        filepath = os.path.join(self.output_dir, filename)
+        unchanged = (
+            not self.force and previous is not None and previous.get("content_hash") == digest
+            and previous["filename"] == filename and os.path.exists(filepath)
+        )
+        entry = {
+            "title": title,
+            "filename": filename,
+            "original_url": url,
+            "downloaded_at": previous["downloaded_at"] if unchanged else datetime.now().isoformat(),
+            "content_hash": digest,
+            "aliases": [],
+        }
+
+        if unchanged:
+            self.counts["unchanged"] += 1
+        else:
+            write_markdown(filepath, title, url, html)
+            self.counts["saved"] += 1
+        # Only pages that made it to disk go into metadata.json
+        self.pages[digest] = entry
+
+    async def worker(self, page):
+        while True:
+            url = await self.queue.get()
+            try:
+                await self.visit(page, url)
+            except Exception as e:
+                # One bad page (unwritable filename, full disk...) must not stop this worker
+                print(f"❌ Error saving page: {url}\n{e}")
+                self.counts["failed"] += 1
+            finally:
+                self.queue.task_done()
+
+    async def crawl(self, context, start_url=BASE_URL, n_pages=PAGES):
+        """Crawl from ``start_url``; returns the metadata entries sorted by filename."""
+        pages = [await context.new_page() for _ in range(n_pages)]
+        self.enqueue(start_url)
+        # A FIFO queue drained by the pool visits pages level by level
+        workers = [asyncio.create_task(self.worker(page)) for page in pages]
+        await self.queue.join()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+        for entry in self.pages.values():
+            entry["aliases"].sort()
+        return sorted(self.pages.values(), key=lambda m: m["filename"])
+
+
+async def main(args):
+    os.makedirs(args.output_dir, exist_ok=True)
+    crawler = Crawler(args.output_dir, load_metadata(), args.force)
+
+    started = time.perf_counter()
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        context = await browser.new_context()
+        metadata = await crawler.crawl(context, args.base_url, args.pages)
+        await browser.close()
+
+    save_metadata(metadata)
+    counts = crawler.counts
+    print(
+        f"\n✅ Completed in {time.perf_counter() - started:.1f}s. {len(metadata)} pages: "
+        f"{counts['saved']} saved, {counts['unchanged']} unchanged, "
+        f"{counts['duplicate']} duplicates, {counts['failed']} failed."
+    )
 
-        print(f"\n✅ Completed. {len(metadata)} pages saved.")
-        browser.close()
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Download the course site as markdown.")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--pages", type=int, default=PAGES, help="browser pages crawling in parallel")
+    parser.add_argument("--force", action="store_true", help="rewrite pages even if their content is unchanged")
+    asyncio.run(main(parser.parse_args()))